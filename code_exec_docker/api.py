@@ -14,13 +14,17 @@ import os
 import time
 import json
 import signal
+import asyncio
 import logging
 import argparse
 import tornado.ioloop
 import tornado.web
 import tornado.httpserver
-from collections import namedtuple
-from jupyter import JupyterKernel, JupyterGatewayLocal
+from tornado.ioloop import IOLoop
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from jupyter import (JupyterKernel, JupyterGatewayLocal, JupyterGatewaySharded,
+                     JUPYTER_GATEWAY_SHARDS, get_gateway_manager)
 
 # 条件导入 Docker 和 Kubernetes 后端
 USE_DOCKER = os.environ.get("USE_DOCKER", "0").lower() == "1"
@@ -50,8 +54,13 @@ if USE_KUBERNETES:
 elif USE_DOCKER:
     JupyterKernelWrapper = JupyterGatewayDocker
     logging.info("Using Docker as the backend for JupyterGateway")
+elif JUPYTER_GATEWAY_SHARDS > 0:
+    # 默认使用本地模式，无需 Docker；所有会话的内核分布在固定数量的共享网关进程上
+    JupyterKernelWrapper = JupyterGatewaySharded
+    logging.info(f"Using Local (no-Docker) as the backend for JupyterGateway, "
+                 f"{JUPYTER_GATEWAY_SHARDS} shared gateway processes")
 else:
-    # 默认使用本地模式，无需 Docker
+    # 本地模式，每个会话一个网关进程
     JupyterKernelWrapper = JupyterGatewayLocal
     logging.info("Using Local (no-Docker) as the backend for JupyterGateway")
 
@@ -62,6 +71,19 @@ JupyterKernelType = namedtuple("JupyterKernelType", [
     "last_access_time"
 ])
 
+# Threads for blocking sandbox start-up/shutdown (gateway processes, containers, pods)
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", "64"))
+sandbox_executor = ThreadPoolExecutor(max_workers=SANDBOX_WORKERS)
+
+# Warm sandbox pool: idle sandboxes kept ready (min), refilled towards a target that
+# follows demand, capped at max. Retired sandboxes are stopped, so every conversation gets
+# a fresh one; RECYCLE=1 opts in to resetting and reusing them instead, which only clears
+# the kernel namespace (cwd, os.environ, sys.path, patched modules and files remain)
+SANDBOX_POOL_MIN = int(os.environ.get("SANDBOX_POOL_MIN", "2"))
+SANDBOX_POOL_TARGET = int(os.environ.get("SANDBOX_POOL_TARGET", "4"))
+SANDBOX_POOL_MAX = int(os.environ.get("SANDBOX_POOL_MAX", "32"))
+SANDBOX_POOL_RECYCLE = os.environ.get("SANDBOX_POOL_RECYCLE", "0") == "1"
+
 def cleanup_kernels(app, force=False):
     """Cleanup kernels and gateway dockers that have timed out."""
     KERNEL_TIMEOUT = 10 * 60  # 10 minutes
@@ -72,7 +94,10 @@ def cleanup_kernels(app, force=False):
     for convid in conv_id_to_kernel.keys():
         last_access = conv_id_to_kernel[convid].last_access_time
         if current_time - last_access > KERNEL_TIMEOUT:
-            to_delete.append(convid)
+            # Skip conversations with an execution still running or queued
+            lock = app.conv_locks.get(convid)
+            if lock is None or not lock.locked():
+                to_delete.append(convid)
 
     if force:
         to_delete = list(conv_id_to_kernel.keys())
@@ -83,53 +108,266 @@ def cleanup_kernels(app, force=False):
         # kernel: JupyterKernel = conv_id_to_kernel[convid].kernel
         # kernel.shutdown()  # Close the JupyterKernel
         # Close the JupyterKernelWrapper by close its context manager
-        kernel_wrapper = conv_id_to_kernel[convid].kernel_wrapper
-        kernel_wrapper.__exit__(None, None, None)  # Close the JupyterKernelWrapper
+        if force:
+            kernel_wrapper = conv_id_to_kernel[convid].kernel_wrapper
+            kernel_wrapper.__exit__(None, None, None)  # Close the JupyterKernelWrapper
+        else:
+            # Reset and return the sandbox to the warm pool, or stop it, off the request path
+            app.sandbox_pool.release(conv_id_to_kernel[convid])
         # Delete the entry from the global data structure
         del conv_id_to_kernel[convid]
+        app.conv_locks.pop(convid, None)
         logging.info(f"Kernel closed for conversation {convid}")
 
+    if force:
+        app.sandbox_pool.shutdown()
+
+
+async def create_kernel(convid):
+    """
+    Start a sandbox and its kernel for a conversation without blocking the IOLoop.
+    The gateway/container start-up busy-waits, so it runs in sandbox_executor.
+    """
+    kernel_wrapper = JupyterKernelWrapper(
+        name=f"conv-{convid}",
+    )
+    url_suffix = await IOLoop.current().run_in_executor(sandbox_executor, kernel_wrapper.__enter__)
+    if os.environ.get("DEBUG", False):
+        logging.info(f"Kernel URL: {url_suffix}")
+    try:
+        kernel = JupyterKernel(url_suffix, convid)
+        await kernel.initialize()
+        if isinstance(kernel_wrapper, JupyterGatewaySharded):
+            # Shared gateways outlive the conversation, its kernel is shut down on exit
+            kernel_wrapper.attach(kernel.kernel_id)
+    except Exception:
+        await IOLoop.current().run_in_executor(sandbox_executor, kernel_wrapper.__exit__, None, None, None)
+        raise
+    logging.info(f"Kernel created for conversation {convid}")
+    return JupyterKernelType(kernel_wrapper, kernel, time.time())
+
+
+async def destroy_kernel(entry):
+    """Stop a sandbox in sandbox_executor."""
+    await IOLoop.current().run_in_executor(sandbox_executor, entry.kernel_wrapper.__exit__, None, None, None)
+
+
+def sandbox_alive(entry):
+    """False once the shared gateway hosting the entry's kernel has exited or restarted."""
+    kernel_wrapper = entry.kernel_wrapper
+    return not isinstance(kernel_wrapper, JupyterGatewaySharded) or kernel_wrapper.alive()
+
+
+class SandboxPool:
+    """
+    Warm pool of initialized gateway+kernel sandboxes.
+
+    Idle sandboxes are refilled in the background towards `target`, which grows by one
+    (up to max) whenever a conversation finds the pool empty and shrinks by one (down to
+    min) after a maintenance tick without demand. Retired sandboxes are stopped, or with
+    recycle reset and put back while fewer than max are idle; both happen off the request path.
+    """
+
+    def __init__(self, min_size=SANDBOX_POOL_MIN, target=SANDBOX_POOL_TARGET,
+                 max_size=SANDBOX_POOL_MAX, recycle=SANDBOX_POOL_RECYCLE):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.target = min(max(target, min_size), self.max_size)
+        self.recycle = recycle
+        self.idle = deque()
+        self.starting = 0
+        self.demand = 0
+        self._count = 0
+
+    async def _start_one(self, name):
+        # self.starting was incremented by refill when this start was scheduled
+        try:
+            entry = await create_kernel(name)
+        except Exception as e:
+            logging.warning(f"Failed to start a pooled sandbox: {e}")
+            return
+        finally:
+            self.starting -= 1
+        self.idle.append(entry)
+
+    def refill(self):
+        """Start sandboxes in the background until idle + starting reaches target."""
+        for _ in range(self.target - len(self.idle) - self.starting):
+            self.starting += 1
+            self._count += 1
+            asyncio.ensure_future(self._start_one(f"pool-{self._count}"))
+
+    def _drop_dead(self):
+        """Stop idle sandboxes whose gateway shard died, so refill replaces them."""
+        dead = [entry for entry in self.idle if not sandbox_alive(entry)]
+        for entry in dead:
+            self.idle.remove(entry)
+            asyncio.ensure_future(destroy_kernel(entry))
+        if dead:
+            logging.warning(f"Dropped {len(dead)} pooled sandboxes on an exited gateway shard")
+
+    def maintain(self):
+        """Periodic tick: drop dead sandboxes, adapt the target to demand and refill."""
+        self._drop_dead()
+        if self.demand == 0 and self.target > self.min_size:
+            self.target -= 1
+            while len(self.idle) > self.target:
+                asyncio.ensure_future(destroy_kernel(self.idle.popleft()))
+        self.demand = 0
+        self.refill()
+
+    async def acquire(self, convid):
+        """Bind a warm sandbox to a conversation, starting a fresh one if none is idle."""
+        self.demand += 1
+        self._drop_dead()
+        if self.idle:
+            entry = self.idle.popleft()
+        else:
+            self.target = min(self.target + 1, self.max_size)
+            entry = await create_kernel(convid)
+        self.refill()
+        entry.kernel.convid = convid
+        return entry._replace(last_access_time=time.time())
+
+    async def _recycle(self, entry):
+        # self.starting was incremented by release, a recycled sandbox counts as starting
+        try:
+            await entry.kernel.reset()
+        except Exception as e:
+            logging.warning(f"Failed to reset sandbox, stopping it: {e}")
+            await destroy_kernel(entry)
+            return
+        finally:
+            self.starting -= 1
+        self.idle.append(entry)
+
+    def release(self, entry):
+        """Retire a conversation's sandbox in the background."""
+        if self.recycle and len(self.idle) + self.starting < self.max_size:
+            self.starting += 1
+            asyncio.ensure_future(self._recycle(entry))
+        else:
+            asyncio.ensure_future(destroy_kernel(entry))
+
+    def shutdown(self):
+        """Stop all idle sandboxes synchronously (used on exit)."""
+        while self.idle:
+            self.idle.popleft().kernel_wrapper.__exit__(None, None, None)
+
+
+async def get_or_create_kernel(app, convid):
+    """
+    Return (kernel entry, created) for a conversation.
+    Concurrent first requests of the same convid share one creation. A kernel lost with
+    its gateway shard is replaced by a new one (reported as created).
+    """
+    entry = app.conv_id_to_kernel.get(convid)
+    if entry is not None and not sandbox_alive(entry):
+        logging.warning(f"Kernel of conversation {convid} was lost with its gateway shard, recreating it")
+        del app.conv_id_to_kernel[convid]
+        asyncio.ensure_future(destroy_kernel(entry))
+    if convid in app.conv_id_to_kernel:
+        return app.conv_id_to_kernel[convid], False
+    creating = app.pending_kernels.get(convid)
+    if creating is None:
+        creating = asyncio.ensure_future(app.sandbox_pool.acquire(convid))
+        app.pending_kernels[convid] = creating
+        try:
+            app.conv_id_to_kernel[convid] = await creating
+        finally:
+            del app.pending_kernels[convid]
+        return app.conv_id_to_kernel[convid], True
+    await creating
+    return app.conv_id_to_kernel[convid], False
+
+
+async def execute_job(app, convid, code, timeout=60, reset=False):
+    """
+    Run one cell in a conversation's kernel and return the structured result dict.
+    With reset, the kernel namespace is cleared first (as between independent tasks).
+    """
+    # Create a new kernel if not exist
+    entry, new_kernel = await get_or_create_kernel(app, convid)
+
+    # Executions of one conversation are queued, different conversations run in parallel
+    lock = app.conv_locks.setdefault(convid, asyncio.Lock())
+    async with lock:
+        # Update last access time
+        app.conv_id_to_kernel[convid] = entry._replace(last_access_time=time.time())
+
+        # Execute the code
+        kernel: JupyterKernel = entry.kernel
+        if reset:
+            await kernel.reset()
+        result = await kernel.run(code, timeout=timeout)
+
+    # "result" keeps the plain string, the other fields carry the structured result
+    result["new_kernel_created"] = new_kernel
+    return result
+
+
 class ExecuteHandler(tornado.web.RequestHandler):
     async def post(self):
         data = json.loads(self.request.body)
         convid = data.get("convid")
         code = data.get("code")
+        timeout = data.get("timeout", 60)
 
-        # Create a new kernel if not exist
-        new_kernel = False
-
-        conv_id_to_kernel = self.application.conv_id_to_kernel
-        if convid not in conv_id_to_kernel:
-            kernel_wrapper = JupyterKernelWrapper(
-                name=f"conv-{convid}",
-            )
-            url_suffix = kernel_wrapper.__enter__()
-            if os.environ.get("DEBUG", False):
-                logging.info(f"Kernel URL: {url_suffix}")
-            kernel = JupyterKernel(url_suffix, convid)
-            await kernel.initialize()
-            conv_id_to_kernel[convid] = JupyterKernelType(
-                kernel_wrapper,
-                kernel,
-                None
-            )
-            new_kernel = True
-            logging.info(f"Kernel created for conversation {convid}")
+        result = await execute_job(self.application, convid, code, timeout)
+        self.write(json.dumps(result))
 
-        # Update last access time
-        kernel_access_time = time.time()
-        conv_id_to_kernel[convid] = conv_id_to_kernel[convid]._replace(
-            last_access_time=kernel_access_time
-        )
 
-        # Execute the code
-        kernel: JupyterKernel = conv_id_to_kernel[convid].kernel
-        result = await kernel.execute(code)
+class ResetHandler(tornado.web.RequestHandler):
+    """Clear a conversation's kernel namespace between independent tasks (JupyterKernel.reset)."""
 
-        self.write(json.dumps({
-            "result": result,
-            "new_kernel_created": new_kernel
-        }))
+    async def post(self):
+        data = json.loads(self.request.body)
+        convid = data.get("convid")
+        app = self.application
+        entry = app.conv_id_to_kernel.get(convid)
+        # A conversation without a kernel has nothing to reset; a lost kernel is recreated
+        # fresh by its next execution
+        if entry is not None and not sandbox_alive(entry):
+            entry = None
+        if entry is not None:
+            async with app.conv_locks.setdefault(convid, asyncio.Lock()):
+                await entry.kernel.reset()
+        self.write(json.dumps({"status": "ok", "kernel_reset": entry is not None}))
+
+
+class ExecuteBatchHandler(tornado.web.RequestHandler):
+    """
+    Run many {convid, code[, timeout, reset]} jobs concurrently and stream one JSON line per
+    job in completion order. Each line is the /execute response plus the job's "index"
+    in the request. Jobs of the same convid run one after another in request order.
+    """
+
+    async def post(self):
+        data = json.loads(self.request.body)
+        jobs = data.get("jobs", [])
+        default_timeout = data.get("timeout", 60)
+        app = self.application
+
+        async def run_job(index, job):
+            try:
+                result = await execute_job(app, job.get("convid"), job.get("code"),
+                                           job.get("timeout", default_timeout), job.get("reset", False))
+            except Exception as e:
+                logging.warning(f"Batch job {index} failed: {e}")
+                result = {"status": "failed", "outputs": [], "ename": "", "evalue": "", "traceback": [],
+                          "execution_time": 0.0, "message": f"[Execution error: {e}]",
+                          "new_kernel_created": False}
+                result["result"] = result["message"]
+            result["index"] = index
+            return result
+
+        self.set_header("Content-Type", "application/x-ndjson")
+        # Start the jobs in request order so same-convid jobs queue on the lock in that order;
+        # as_completed on bare coroutines would schedule them in arbitrary (set) order
+        tasks = [asyncio.ensure_future(run_job(i, job)) for i, job in enumerate(jobs)]
+        for finished in asyncio.as_completed(tasks):
+            self.write(json.dumps(await finished) + "\n")
+            await self.flush()
 
 
 if __name__ == "__main__":
@@ -139,9 +377,16 @@ if __name__ == "__main__":
 
     app = tornado.web.Application([
         (r"/execute", ExecuteHandler),
+        (r"/execute_batch", ExecuteBatchHandler),
+        (r"/reset", ResetHandler),
         # Add other routes here
     ])
     app.conv_id_to_kernel = {}
+    # convid -> future of a kernel being created, and per-conversation execution locks
+    app.pending_kernels = {}
+    app.conv_locks = {}
+    app.sandbox_pool = SandboxPool()
+    IOLoop.current().add_callback(app.sandbox_pool.refill)
     
     # Wrap cleanup_kernels to pass the app object
     periodic_cleanup = tornado.ioloop.PeriodicCallback(
@@ -150,9 +395,19 @@ if __name__ == "__main__":
     )
     periodic_cleanup.start()
 
+    # Adapt the warm pool to demand and refill it
+    pool_maintenance = tornado.ioloop.PeriodicCallback(
+        app.sandbox_pool.maintain,
+        int(os.environ.get("SANDBOX_POOL_INTERVAL_MS", 10000))
+    )
+    pool_maintenance.start()
+
     # Setup signal handler
     def signal_handler(signum, frame, app):
         logging.info("Received SIGINT, cleaning up...")
+        if JupyterKernelWrapper is JupyterGatewaySharded:
+            # Stopping the shared gateways stops all kernels at once
+            get_gateway_manager().shutdown()
         cleanup_kernels(app, force=True)
         tornado.ioloop.IOLoop.current().stop()
         logging.info("Cleanup complete, shutting down.")
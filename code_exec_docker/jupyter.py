@@ -7,6 +7,9 @@ Jupyter Kernel Gateway module - supports multiple backends (Local/Docker/Kuberne
 2. JupyterGatewayDocker: Docker 容器模式
 3. JupyterGatewayKubernetes: Kubernetes 集群模式
 
+本地模式下默认由 ShardedGatewayManager 运行固定数量的共享网关进程（JupyterGatewaySharded），
+每个会话只在负载最低的网关上创建一个内核；JUPYTER_GATEWAY_SHARDS=0 时每个会话启动一个网关
+
 通过环境变量选择后端:
 - USE_DOCKER=1: 使用 Docker 后端
 - USE_KUBERNETES=1: 使用 Kubernetes 后端
@@ -22,6 +25,8 @@ import logging
 import subprocess
 import signal
 import socket
+import threading
+import urllib.request
 
 from tornado.escape import json_encode, json_decode, url_escape
 from tornado.websocket import websocket_connect, WebSocketHandler
@@ -92,7 +97,62 @@ def strip_ansi(o: str) -> str:
     stripped = pattern.sub('', o)
     return stripped
 
+# Clears the user namespace, closes lingering file handles and zip archives
+# (e.g. read-only openpyxl workbooks) and runs gc. Modules already imported
+# stay in sys.modules, so the kernel keeps its warm imports.
+# Used by /reset, /execute_batch jobs with reset and the warm pool; the inference
+# package keeps the local-backend counterpart in inference/kernel_snippets.py, keep
+# the two in sync.
+RESET_CODE = """%reset -f
+import gc as _gc, io as _io, os as _os, zipfile as _zipfile
+_gc.collect()
+for _obj in _gc.get_objects():
+    try:
+        if isinstance(_obj, _zipfile.ZipFile):
+            if _obj.fp is not None and isinstance(_obj.filename, str):
+                _obj.close()
+        elif isinstance(_obj, _io.IOBase) and not _obj.closed:
+            if isinstance(getattr(_obj, 'name', None), str) and _os.path.isfile(_obj.name):
+                _obj.close()
+    except Exception:
+        pass
+_obj = None
+_gc.collect()
+del _gc, _io, _os, _zipfile, _obj
+"""
+
+def render_result(result):
+    """Render a structured result as the plain string returned by earlier versions."""
+    if result["status"] in ("timeout", "failed"):
+        return result["message"]
+    parts = []
+    for output in result["outputs"]:
+        if output["output_type"] == "stream":
+            parts.append(output["text"])
+            continue
+        parts.append(output["data"].get("text/plain", ""))
+        if "image/png" in output["data"]:
+            # use markdone to display image (in case of large image)
+            parts.append(f"![image](data:image/png;base64,{output['data']['image/png']})")
+    if result["message"]:
+        parts.append(result["message"])
+    if result["traceback"]:
+        parts.append("\n\n\n\n".join(result["traceback"]))
+    if not parts:
+        return "[Code executed successfully with no output]"
+    return "".join(parts)
+
+
 class JupyterKernel:
+    """
+    Client of one kernel on a gateway.
+
+    A single websocket per kernel is read by one long-lived reader task, which routes
+    every message to the queue of the request whose msg_id is its parent. Executions
+    therefore never drop each other's messages and several can be in flight (pipelined)
+    on the same kernel; the kernel still runs them one after another.
+    """
+
     def __init__(
         self,
         url_suffix,
@@ -110,6 +170,11 @@ class JupyterKernel:
         self.heartbeat_interval = 10000  # 10 seconds
         self.heartbeat_callback = None
 
+        # msg_id -> queue of routed messages, filled by the reader task
+        self.pending = {}
+        self.reader = None
+        self._connect_lock = asyncio.Lock()
+
     async def initialize(self):
         await self.execute(r"%colors nocolor")
         # pre-defined tools
@@ -120,24 +185,54 @@ class JupyterKernel:
             # logging.info(f"Tool initialized:\n{tool}")
             await self.execute(tool)
     
+    async def reset(self):
+        """Cheap reset between tasks instead of restarting the kernel."""
+        await self.execute(RESET_CODE)
+        for tool in self.tools_to_run:
+            await self.execute(tool)
+
     async def _send_heartbeat(self):
         if not self.ws:
             return
         try:
             self.ws.ping()
             # logging.info("Heartbeat sent...")
-        except tornado.iostream.StreamClosedError:
-            # logging.info("Heartbeat failed, reconnecting...")
-            try:
-                await self._connect()
-            except ConnectionRefusedError:
-                logging.info("ConnectionRefusedError: Failed to reconnect to kernel websocket - Is the kernel still running?")
+        except (tornado.iostream.StreamClosedError, tornado.websocket.WebSocketClosedError):
+            # The reader task sees the close too; the next request reconnects
+            pass
+
+    async def _read_messages(self, ws):
+        """Route messages of `ws` to the pending requests until the websocket closes."""
+        try:
+            while True:
+                raw = await ws.read_message()
+                if raw is None:
+                    break
+                if not self.pending:
+                    # Nothing in flight (e.g. late output of a timed-out cell), skip decoding
+                    continue
+                msg = json.loads(raw)
+                queue = self.pending.get(msg["parent_header"].get("msg_id"))
+                if queue is not None:
+                    queue.put_nowait((msg["msg_type"], msg["content"]))
+        except Exception as e:
+            logging.warning(f"Kernel websocket reader failed for conversation {self.convid}: {e}")
+            ws.close()
+        finally:
+            logging.info(f"Kernel websocket closed for conversation {self.convid}")
+            if self.ws is ws:
+                self.ws = None
+            # Wake up requests that were waiting on this connection
+            for queue in self.pending.values():
+                queue.put_nowait(None)
 
     async def _connect(self):
-        if self.ws:
-            self.ws.close()
-            self.ws = None
+        async with self._connect_lock:
+            if self.ws:
+                return
+            await self._open()
 
+    async def _open(self):
         client = AsyncHTTPClient()
         if not self.kernel_id:
             n_tries = 5
@@ -165,6 +260,7 @@ class JupyterKernel:
             )
         )
         self.ws = await websocket_connect(ws_req)
+        self.reader = asyncio.ensure_future(self._read_messages(self.ws))
         logging.info("Connected to kernel websocket")
 
         # Setup heartbeat
@@ -174,68 +270,93 @@ class JupyterKernel:
         self.heartbeat_callback.start()
 
     async def execute(self, code, timeout=60):
+        result = await self.run(code, timeout)
+        return result["result"]
+
+    async def run(self, code, timeout=60):
+        """
+        Execute code and return a structured result:
+        status (ok / error / timeout / failed), outputs in arrival order (nbformat style),
+        ename / evalue / traceback frames, execution_time and the legacy "result" string.
+        Safe to call concurrently on the same kernel.
+        """
         if not self.ws:
             await self._connect()
 
+        start = time.monotonic()
         msg_id = uuid4().hex
-        self.ws.write_message(
-            json_encode(
-                {
-                    "header": {
-                        "username": "",
-                        "version": "5.0",
-                        "session": "",
-                        "msg_id": msg_id,
-                        "msg_type": "execute_request",
-                    },
-                    "parent_header": {},
-                    "channel": "shell",
-                    "content": {
-                        "code": code,
-                        "silent": False,
-                        "store_history": False,
-                        "user_expressions": {},
-                        "allow_stdin": False,
-                    },
-                    "metadata": {},
-                    "buffers": {},
-                }
-            )
+        queue = asyncio.Queue()
+        request = json_encode(
+            {
+                "header": {
+                    "username": "",
+                    "version": "5.0",
+                    "session": "",
+                    "msg_id": msg_id,
+                    "msg_type": "execute_request",
+                },
+                "parent_header": {},
+                "channel": "shell",
+                "content": {
+                    "code": code,
+                    "silent": False,
+                    "store_history": False,
+                    "user_expressions": {},
+                    "allow_stdin": False,
+                },
+                "metadata": {},
+                "buffers": {},
+            }
         )
 
-        outputs = []
+        result = {
+            "status": "ok",
+            "outputs": [],
+            "ename": "",
+            "evalue": "",
+            "traceback": [],
+            "execution_time": 0.0,
+            "message": "",
+        }
 
+        def connection_lost():
+            result["status"] = "failed"
+            result["message"] = "[Execution error: kernel connection lost]"
 
         async def wait_for_messages():
-            execution_done = False
-            while not execution_done:
-                msg = await self.ws.read_message()
-                msg = json_decode(msg)
-                msg_type = msg['msg_type']
-                parent_msg_id = msg['parent_header'].get('msg_id', None)
-
-                if parent_msg_id != msg_id:
-                    continue
+            # Done once the shell reply and the iopub idle status have both arrived,
+            # so output published after the reply is not lost
+            replied = idle = False
+            while not (replied and idle):
+                routed = await queue.get()
+                if routed is None:
+                    connection_lost()
+                    return
+                msg_type, content = routed
 
                 if os.environ.get("DEBUG", False):
-                    logging.info(f"MSG TYPE: {msg_type.upper()} DONE:{execution_done}\nCONTENT: {msg['content']}")
+                    logging.info(f"MSG TYPE: {msg_type.upper()}\nCONTENT: {content}")
 
                 if msg_type == 'error':
-                    traceback = "\n\n\n\n".join(msg["content"]["traceback"])
-                    outputs.append(traceback)
-                    execution_done = True
+                    result["status"] = "error"
+                    result["ename"] = content.get("ename", "")
+                    result["evalue"] = content.get("evalue", "")
+                    result["traceback"] = [strip_ansi(frame) for frame in content["traceback"]]
                 elif msg_type == 'stream':
-                    outputs.append(msg['content']['text'])
+                    result["outputs"].append({
+                        "output_type": "stream",
+                        "name": content.get('name', 'stdout'),
+                        "text": strip_ansi(content['text']),
+                    })
                 elif msg_type in ['execute_result', 'display_data']:
-                    outputs.append(msg['content']['data']['text/plain'])
-                    if 'image/png' in msg['content']['data']:
-                        # use markdone to display image (in case of large image)
-                        # outputs.append(f"\n<img src=\"data:image/png;base64,{msg['content']['data']['image/png']}\"/>\n")
-                        outputs.append(f"![image](data:image/png;base64,{msg['content']['data']['image/png']})")
-
+                    data = {"text/plain": strip_ansi(content['data'].get('text/plain', ''))}
+                    if 'image/png' in content['data']:
+                        data['image/png'] = content['data']['image/png']
+                    result["outputs"].append({"output_type": msg_type, "data": data})
                 elif msg_type == 'execute_reply':
-                    execution_done = True
-            return execution_done
+                    replied = True
+                elif msg_type == 'status' and content.get('execution_state') == 'idle':
+                    idle = True
 
         async def interrupt_kernel():
             client = AsyncHTTPClient()
@@ -246,25 +367,34 @@ class JupyterKernel:
             )
             logging.info(f"Kernel interrupted: {interrupt_response}")
 
+        # Register before sending so no reply can arrive unrouted
+        self.pending[msg_id] = queue
         try:
-            execution_done = await asyncio.wait_for(wait_for_messages(), timeout)
+            if self.ws is None:
+                raise tornado.websocket.WebSocketClosedError()
+            self.ws.write_message(request)
+            await asyncio.wait_for(wait_for_messages(), timeout)
+        except (tornado.iostream.StreamClosedError, tornado.websocket.WebSocketClosedError):
+            # The websocket closed between connecting and sending
+            connection_lost()
         except asyncio.TimeoutError:
             await interrupt_kernel()
-            return f"[Execution timed out ({timeout} seconds).]"
-
-        if not outputs and execution_done:
-            ret = "[Code executed successfully with no output]"
-        else:
-            ret = ''.join(outputs)
+            result["status"] = "timeout"
+            result["message"] = f"[Execution timed out ({timeout} seconds).]"
+        finally:
+            del self.pending[msg_id]
 
-        # Remove ANSI
-        ret = strip_ansi(ret) 
+        result["execution_time"] = time.monotonic() - start
+        result["result"] = render_result(result)
 
         if os.environ.get("DEBUG", False):
-            logging.info(f"OUTPUT:\n{ret}")
-        return ret
+            logging.info(f"OUTPUT:\n{result['result']}")
+        return result
 
     async def shutdown_async(self):
+        if self.heartbeat_callback:
+            self.heartbeat_callback.stop()
+            self.heartbeat_callback = None
         if self.kernel_id:
             client = AsyncHTTPClient()
             await client.fetch(
@@ -272,9 +402,9 @@ class JupyterKernel:
                 method="DELETE",
             )
             self.kernel_id = None
-            if self.ws:
-                self.ws.close()
-                self.ws = None
+        if self.ws:
+            self.ws.close()
+            self.ws = None
 
 class JupyterGatewayDocker:
     DOCKER_IMAGE = "docker.io/xingyaoww/codeact-executor"
@@ -456,14 +586,17 @@ class JupyterGatewayLocal:
             result = await kernel.execute("print('hello')")
     """
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, discard_output: bool = False):
         """
         初始化本地网关
 
         参数:
             name: 网关实例名称，用于日志标识
+            discard_output: 丢弃网关日志而不是写入管道（长期运行、承载多个内核的网关需要，
+                            否则无人读取的管道写满后网关会阻塞）
         """
         self.name = name
+        self.discard_output = discard_output
         self.process = None  # 子进程句柄
         self.port = None     # 分配的端口号
 
@@ -520,10 +653,11 @@ class JupyterGatewayLocal:
         logging.info(f"Starting Jupyter Kernel Gateway: {' '.join(cmd)}")
 
         # 启动子进程，创建新的进程组以便于清理
+        output = subprocess.DEVNULL if self.discard_output else subprocess.PIPE
         self.process = subprocess.Popen(
             cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=output,
+            stderr=output,
             preexec_fn=os.setsid if os.name != 'nt' else None
         )
 
@@ -559,6 +693,180 @@ class JupyterGatewayLocal:
             logging.info(f"Jupyter Kernel Gateway stopped for {self.name}")
 
 
+# Number of shared gateway processes hosting the kernels of all conversations
+# (local backend only); 0 starts one gateway per conversation instead
+JUPYTER_GATEWAY_SHARDS = int(os.environ.get(
+    "JUPYTER_GATEWAY_SHARDS", str(max(1, (os.cpu_count() or 1) // 4))))
+
+
+class GatewayShard:
+    """
+    One shared local gateway process, started on first use and restarted if it died.
+
+    A restart gets a new port and none of the old kernels, so every start bumps
+    `generation`; placements made under an older generation are stale.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.gateway = JupyterGatewayLocal(f"shard-{index}", discard_output=True)
+        self.url_suffix = None
+        self.load = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        """Start the gateway if needed; returns (url suffix, generation)."""
+        with self._lock:
+            process = self.gateway.process
+            if process is None or process.poll() is not None:
+                if process is not None:
+                    logging.warning(f"Jupyter Kernel Gateway shard {self.index} exited, restarting it")
+                    self.gateway.process = None
+                self.url_suffix = self.gateway.__enter__()
+                self.generation += 1
+            return self.url_suffix, self.generation
+
+    def running(self):
+        return self.gateway.process is not None and self.gateway.process.poll() is None
+
+    def stop(self):
+        with self._lock:
+            if self.running():
+                self.gateway.__exit__(None, None, None)
+            self.gateway.process = None
+            self.url_suffix = None
+
+
+class ShardedGatewayManager:
+    """
+    Runs a fixed number of local gateway processes and places kernels on them.
+
+    Each conversation gets its own kernel on the least-loaded shard instead of its own
+    gateway process. Placements (name -> shard, kernel id, generation) are tracked so a
+    conversation's kernel can be shut down through its gateway when the conversation is
+    cleaned up. When a shard's gateway dies its placements are evicted and its load is
+    recomputed, and `alive` reports them dead so their owners recreate the kernels.
+    Methods are thread-safe; they block and are meant to run off the IOLoop.
+    """
+
+    def __init__(self, num_shards: int = JUPYTER_GATEWAY_SHARDS):
+        self.shards = [GatewayShard(i) for i in range(max(num_shards, 1))]
+        self.placements = {}  # name -> (shard, kernel_id, generation)
+        self._lock = threading.Lock()
+
+    def _evict_stale(self):
+        """Drop placements whose kernel died with its gateway. Caller holds self._lock."""
+        for name, (shard, _, generation) in list(self.placements.items()):
+            # generation None: slot reserved, gateway not (re)started for it yet
+            if generation is not None and (generation != shard.generation or not shard.running()):
+                del self.placements[name]
+                shard.load -= 1
+                logging.warning(f"Dropped placement {name}: gateway shard {shard.index} exited")
+
+    def place(self, name: str) -> str:
+        """Reserve a kernel slot for `name` on the least-loaded shard and return its url suffix."""
+        with self._lock:
+            self._evict_stale()
+            shard = min(self.shards, key=lambda shard: shard.load)
+            shard.load += 1
+            self.placements[name] = (shard, None, None)
+        try:
+            url_suffix, generation = shard.ensure_running()
+        except Exception:
+            self.release(name)
+            raise
+        with self._lock:
+            if name in self.placements:
+                self.placements[name] = (shard, None, generation)
+            self._evict_stale()
+        return url_suffix
+
+    def bind(self, name: str, kernel_id: str):
+        """Record the kernel started for a placement."""
+        with self._lock:
+            if name in self.placements:
+                shard, _, generation = self.placements[name]
+                self.placements[name] = (shard, kernel_id, generation)
+
+    def alive(self, name: str) -> bool:
+        """Whether the placement's gateway is still the one its kernel was started on."""
+        with self._lock:
+            placement = self.placements.get(name)
+            if placement is None:
+                return False
+            shard, _, generation = placement
+            return shard.running() and generation == shard.generation
+
+    def release(self, name: str):
+        """Shut down the kernel of a placement through its gateway and free the slot."""
+        with self._lock:
+            placement = self.placements.pop(name, None)
+            if placement is None:
+                return
+            shard, kernel_id, generation = placement
+            shard.load -= 1
+            url_suffix = shard.url_suffix if shard.running() and generation == shard.generation else None
+        if kernel_id and url_suffix:
+            request = urllib.request.Request(
+                f"http://{url_suffix}/api/kernels/{kernel_id}", method="DELETE")
+            try:
+                urllib.request.urlopen(request, timeout=30).close()
+            except Exception as e:
+                logging.warning(f"Failed to shut down kernel {kernel_id} on gateway shard {shard.index}: {e}")
+
+    def loads(self):
+        with self._lock:
+            return [shard.load for shard in self.shards]
+
+    def shutdown(self):
+        """Stop all gateway processes (and with them every kernel they host)."""
+        with self._lock:
+            self.placements.clear()
+            for shard in self.shards:
+                shard.load = 0
+        for shard in self.shards:
+            shard.stop()
+
+
+gateway_manager = None
+
+
+def get_gateway_manager():
+    """Process-wide ShardedGatewayManager, created on first use."""
+    global gateway_manager
+    if gateway_manager is None:
+        gateway_manager = ShardedGatewayManager()
+    return gateway_manager
+
+
+class JupyterGatewaySharded:
+    """
+    Same interface as the other gateway wrappers, but the kernel lives on a shared
+    gateway shard. Entering places the conversation on the least-loaded shard; the
+    kernel id must be attached once the kernel is started so exiting can shut it down.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # names can repeat (a conversation id coming back after cleanup), placements must not
+        self.placement = f"{name}-{uuid4().hex[:8]}"
+        self.manager = get_gateway_manager()
+
+    def __enter__(self):
+        return self.manager.place(self.placement)
+
+    def attach(self, kernel_id: str):
+        self.manager.bind(self.placement, kernel_id)
+
+    def alive(self):
+        """False once the shard hosting this kernel has exited or been restarted."""
+        return self.manager.alive(self.placement)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.manager.release(self.placement)
+
+
 if __name__ == "__main__":
 
     TO_EXEC = """
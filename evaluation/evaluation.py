@@ -1,12 +1,19 @@
 import os
 import json
+import time
+import pickle
+import hashlib
+import tempfile
 import datetime
 import openpyxl
 import argparse
 import numpy as np
 from tqdm import tqdm
+from functools import lru_cache
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl.styles import PatternFill, Font
+from openpyxl.utils.cell import range_boundaries
 
 
 def datetime_to_float(dt):
@@ -47,6 +54,110 @@ def compare_cell_value(v1, v2):
         return False
 
 
+# value kinds used by normalize_block
+KIND_EMPTY, KIND_NUMBER, KIND_STRING, KIND_DATETIME, KIND_TIME, KIND_OTHER = range(6)
+
+
+def _value_kind(v):
+    if v is None or (isinstance(v, str) and v == ""):
+        return KIND_EMPTY
+    if isinstance(v, (int, float)):
+        return KIND_NUMBER
+    if isinstance(v, str):
+        return KIND_STRING
+    if isinstance(v, datetime.datetime):
+        return KIND_DATETIME
+    if isinstance(v, datetime.time):
+        return KIND_TIME
+    return KIND_OTHER
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+
+def round_array(values, ndigits):
+    """
+    Round a float array with np.round, giving the same results as the built-in round.
+    np.round scales by 10**ndigits, so a value within a few ulps of a half-way point
+    (such as 0.765) can round the other way; only those, and values too large to scale
+    exactly, are rounded again with round().
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+        rounded = np.round(values, ndigits)
+        scaled = values * 10.0 ** ndigits
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 8 * np.spacing(np.abs(scaled))
+        suspect = near_tie | ~(np.abs(scaled) < 2.0 ** 52)
+    for i in np.flatnonzero(suspect):
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+
+def normalize_block(rows):
+    """
+    Normalize a 2-D block of cell values the way transform_value does, column-typed:
+    returns (is_num, num, obj) where is_num marks numeric values, num holds them rounded
+    in a float array and obj holds the remaining values with empty cells as "".
+    """
+    n_rows, n_cols = len(rows), len(rows[0]) if rows else 0
+    flat = np.empty(n_rows * n_cols, dtype=object)
+    for i, row in enumerate(rows):
+        flat[i * n_cols:(i + 1) * n_cols] = row
+    kinds = np.fromiter((_value_kind(v) for v in flat), dtype=np.int8, count=flat.size)
+
+    # numbers, numeric strings (compared as numbers) and datetimes (Excel serial days)
+    # are collected as floats and rounded together, as transform_value rounds them
+    num = np.zeros(flat.size, dtype=np.float64)
+    is_num = kinds == KIND_NUMBER
+    num_idx = np.flatnonzero(is_num)
+    num[num_idx] = np.array([float(v) for v in flat[num_idx]], dtype=np.float64)
+
+    str_idx = np.flatnonzero(kinds == KIND_STRING)
+    str_num = [_to_float(v) for v in flat[str_idx]]
+    parsed = np.array([f is not None for f in str_num], dtype=bool)
+    str_idx = str_idx[parsed]
+    num[str_idx] = [f for f in str_num if f is not None]
+    is_num[str_idx] = True
+    num_idx = np.concatenate([num_idx, str_idx])
+    num[num_idx] = round_array(num[num_idx], 2)
+
+    # rounding to whole days does not scale, np.round already matches round()
+    dt_idx = np.flatnonzero(kinds == KIND_DATETIME)
+    num[dt_idx] = np.round([datetime_to_float(v) for v in flat[dt_idx]], 0)
+    is_num[dt_idx] = True
+
+    obj = flat.copy()
+    obj[kinds == KIND_EMPTY] = ""
+    time_idx = np.flatnonzero(kinds == KIND_TIME)
+    obj[time_idx] = [str(v)[:-3] for v in flat[time_idx]]
+    obj[is_num] = None
+    num[~is_num] = 0.0
+
+    shape = (n_rows, n_cols)
+    return is_num.reshape(shape), num.reshape(shape), obj.reshape(shape)
+
+
+def block_mismatches(block_gt, block_proc):
+    """ Boolean mask of cells whose normalized values differ, same rules as compare_cell_value """
+    is_num_gt, num_gt, obj_gt = block_gt
+    is_num_proc, num_proc, obj_proc = block_proc
+    both_num = is_num_gt & is_num_proc
+    both_obj = ~is_num_gt & ~is_num_proc
+    match = both_num & (num_gt == num_proc)
+    if both_obj.any():
+        match[both_obj] = obj_gt[both_obj] == obj_proc[both_obj]
+    return ~match
+
+
+def _display_value(block, row_idx, col_idx):
+    is_num, num, obj = block
+    return num[row_idx, col_idx] if is_num[row_idx, col_idx] else obj[row_idx, col_idx]
+
+
 def _get_color_rgb(color) -> str:
     """Extract RGB value from color object, defaulting to '00000000' if not a string."""
     if color and isinstance(color.rgb, str):
@@ -73,6 +184,7 @@ def compare_font_color(font_gt, font_proc) -> bool:
     return _compare_colors(font_gt.color, font_proc.color)
 
 
+@lru_cache(maxsize=None)
 def col_num2name(n):
     """ Convert a column number to an Excel column name """
     name = ''
@@ -82,6 +194,7 @@ def col_num2name(n):
     return name
 
 
+@lru_cache(maxsize=None)
 def col_name2num(name):
     """ Convert an Excel column name to a column number """
     num = 0
@@ -90,6 +203,7 @@ def col_name2num(name):
     return num
 
 
+@lru_cache(maxsize=None)
 def parse_cell_range(range_str):
     """ Parse a range string like 'A1:AB12' """
     start_cell, end_cell = range_str.split(':')
@@ -120,45 +234,114 @@ def generate_cell_names(range_str):
     return cell_names
 
 
-def cell_level_compare(wb_gt, wb_proc, sheet_name, cell_range):
-    if sheet_name not in wb_proc:
+@lru_cache(maxsize=None)
+def range_bounds(range_str):
+    """
+    Return (min_row, max_row, min_col, max_col) of a range like 'A1:AB12' or a single cell.
+    Ranges go through parse_cell_range like generate_cell_names did, single cells through
+    openpyxl like ws[cell_name] did, so unusual input resolves to the same cells as before.
+    """
+    if ':' in range_str:
+        (start_col, start_row), (end_col, end_row) = parse_cell_range(range_str)
+        return start_row, end_row, start_col, end_col
+    min_col, min_row, max_col, max_row = range_boundaries(range_str)
+    return min_row, max_row, min_col, max_col
+
+
+@lru_cache(maxsize=None)
+def compile_answer_position(answer_position):
+    """
+    Compile answer_position once into a plan of (sheet_name, min_row, max_row, min_col, max_col)
+    tuples; sheet_name is None for ranges on the first sheet. Parsing follows the original
+    compare_workbooks exactly: plain split on ',' and '!', only quotes stripped (no whitespace
+    stripping or '' unescaping), so a name like " Sheet1" still fails to match a sheet.
+    """
+    plan = []
+    for sheet_cell_range in answer_position.split(','):
+        if '!' in sheet_cell_range:
+            sheet_name, cell_range = sheet_cell_range.split('!')
+            sheet_name = sheet_name.lstrip("'").rstrip("'")
+        else:
+            sheet_name = None
+            cell_range = sheet_cell_range
+        cell_range = cell_range.lstrip("'").rstrip("'")
+        plan.append((sheet_name,) + range_bounds(cell_range))
+    return tuple(plan)
+
+
+def as_plan(answer_position):
+    """ Accept either a raw answer_position string or an already compiled plan """
+    if isinstance(answer_position, str):
+        return compile_answer_position(answer_position)
+    return answer_position
+
+
+def read_range_values(filename, plan, default_sheet=None):
+    """
+    Stream only the ranges of a compiled answer_position plan in read-only mode.
+    Rows after the last requested row of a sheet are never parsed.
+    Returns the sheet names and {(sheet_name, min_row, max_row, min_col, max_col): 2-D list
+    of values}, ranges on missing sheets are left out.
+    """
+    wb = openpyxl.load_workbook(filename=filename, read_only=True, data_only=True)
+    try:
+        sheetnames = wb.sheetnames
+        if default_sheet is None:
+            default_sheet = sheetnames[0]
+        blocks = {}
+        for sheet_name, min_row, max_row, min_col, max_col in plan:
+            sheet_name = default_sheet if sheet_name is None else sheet_name
+            if sheet_name not in sheetnames:
+                continue
+            n_cols = max_col - min_col + 1
+            rows = [list(row)[:n_cols] for row in wb[sheet_name].iter_rows(
+                min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col, values_only=True)]
+            # pad short rows and rows missing at the end of the sheet
+            rows = [row + [None] * (n_cols - len(row)) for row in rows[:max_row - min_row + 1]]
+            rows += [[None] * n_cols for _ in range(max_row - min_row + 1 - len(rows))]
+            blocks[(sheet_name, min_row, max_row, min_col, max_col)] = rows
+        return sheetnames, blocks
+    finally:
+        wb.close()
+
+
+def cell_level_compare(values_gt, values_proc, min_row, min_col):
+    """ Compare two normalized blocks (see normalize_block) starting at (min_row, min_col) in one shot """
+    if values_proc is None:
         return False, "worksheet not found"
-    ws_gt = wb_gt[sheet_name]
-    ws_proc = wb_proc[sheet_name]
-
-    cell_names = generate_cell_names(cell_range)
-
-    for cell_name in cell_names:
-        cell_gt = ws_gt[cell_name]
-        cell_proc = ws_proc[cell_name]
-
-        if not compare_cell_value(cell_gt.value, cell_proc.value):
-            msg = f"Value difference at cell {cell_gt.coordinate}: ws_gt has {cell_gt.value},\
-                    ws_proc has {cell_proc.value}"
-            return False, msg
-        
-        # if not compare_fill_color(cell_gt.fill, cell_proc.fill):
-        #     msg = f"Fill color difference at cell {cell_gt.coordinate}: ws_gt has {cell_gt.fill.fgColor.rgb},\
-        #             ws_proc has {cell_proc.fill.fgColor.rgb}"
-        #     return False, msg
-
-        # if not compare_font_color(cell_gt.font, cell_proc.font):
-        #     # msg = f"Font color difference at cell {cell_gt.coordinate}: ws_gt has {cell_gt.font.color.rgb},\
-        #     #        ws_proc has {cell_proc.font.color.rgb}"
-        #     msg = f"Font color difference at cell {cell_gt.coordinate}"
-        #     return False, msg
+
+    mismatches = block_mismatches(values_gt, values_proc)
+    if mismatches.any():
+        # report the first difference in column-major order, same as generate_cell_names
+        col_idx, row_idx = np.argwhere(mismatches.T)[0]
+        coordinate = f"{col_num2name(min_col + col_idx)}{min_row + row_idx}"
+        msg = f"Value difference at cell {coordinate}: ws_gt has {_display_value(values_gt, row_idx, col_idx)},\
+                    ws_proc has {_display_value(values_proc, row_idx, col_idx)} ({int(mismatches.sum())} cells differ)"
+        return False, msg
 
     print("Cell values in the specified range are identical.")
     return True, ""
 
 
-def compare_workbooks(gt_file, proc_file, instruction_type, answer_position):
+def compare_workbooks(gt_file, proc_file, instruction_type, answer_position, gt_values=None):
+    """
+    gt_values: optional precompiled (sheetnames, normalized blocks) of gt_file from
+    GroundTruthStore, when given only proc_file is opened
+    """
     if not os.path.exists(proc_file):
         return False, "File not exist"
-    # Open workbooks
+
+    # Compile the answer ranges first, then read only those ranges from both workbooks
+    plan = as_plan(answer_position)
     try:
-        wb_gt = openpyxl.load_workbook(filename=gt_file, data_only=True)
-        wb_proc = openpyxl.load_workbook(filename=proc_file, data_only=True)
+        if gt_values is None:
+            gt_sheetnames, blocks_gt = read_range_values(gt_file, plan)
+            blocks_gt = {key: normalize_block(rows) for key, rows in blocks_gt.items()}
+        else:
+            gt_sheetnames, blocks_gt = gt_values
+        default_sheet = gt_sheetnames[0]
+        _, blocks_proc = read_range_values(proc_file, plan, default_sheet=default_sheet)
+        blocks_proc = {key: normalize_block(rows) for key, rows in blocks_proc.items()}
     except Exception as e:
         return False, str(e)
 
@@ -166,28 +349,105 @@ def compare_workbooks(gt_file, proc_file, instruction_type, answer_position):
     result = False
     msg = ""
 
-    sheet_cell_ranges = answer_position.split(',')
     result_list = []
     msg_list = []
-    for sheet_cell_range in sheet_cell_ranges:
-        if '!' in sheet_cell_range:
-            sheet_name, cell_range = sheet_cell_range.split('!')
-            sheet_name = sheet_name.lstrip("'").rstrip("'")
-        else:
-            sheet_name = wb_gt.sheetnames[0]
-            cell_range = sheet_cell_range
-    
-        # process sheet_name and cell_range
-        sheet_name = sheet_name.lstrip("'").rstrip("'")
-        cell_range = cell_range.lstrip("'").rstrip("'")
+    for sheet_name, min_row, max_row, min_col, max_col in plan:
+        sheet_name = default_sheet if sheet_name is None else sheet_name
+        key = (sheet_name, min_row, max_row, min_col, max_col)
+        if key not in blocks_gt:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
 
-        result, msg = cell_level_compare(wb_gt, wb_proc, sheet_name, cell_range)
+        result, msg = cell_level_compare(blocks_gt[key], blocks_proc.get(key), min_row, min_col)
         result_list.append(result)
         msg_list.append(msg)
 
     return all(result_list), ""
 
 
+# bump when the layout of compiled entries changes
+GT_STORE_VERSION = 5
+
+
+def file_digest(filename):
+    """ blake2b digest of the file content """
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compile_ground_truth(job):
+    """ Read the answer ranges of one ground-truth file and normalize them with normalize_block """
+    gt_file, answer_position = job
+    try:
+        digest = file_digest(gt_file)
+        sheetnames, blocks = read_range_values(gt_file, as_plan(answer_position))
+    except Exception:
+        # leave it to compare_workbooks to fail on this file as before
+        return gt_file, None
+    blocks = {key: normalize_block(rows) for key, rows in blocks.items()}
+    return gt_file, {
+        'version': GT_STORE_VERSION,
+        'digest': digest,
+        'answer_position': answer_position,
+        'values': (sheetnames, blocks),
+    }
+
+
+class GroundTruthStore:
+    """
+    Precompiled ground-truth answers shared by all models and settings.
+    Holds the normalized answer ranges (normalize_block arrays) of every *_answer.xlsx
+    in one pickle file; an entry is rebuilt when its file hash or answer_position changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as fp:
+                    self.entries = pickle.load(fp)
+            except Exception:
+                self.entries = {}
+
+    def _is_valid(self, gt_file, answer_position):
+        entry = self.entries.get(gt_file)
+        return (entry is not None
+                and entry.get('version') == GT_STORE_VERSION
+                and entry['answer_position'] == answer_position
+                and os.path.exists(gt_file)
+                and entry['digest'] == file_digest(gt_file))
+
+    def compile(self, jobs, workers=1):
+        """ Build missing or stale entries for (gt_file, answer_position) jobs """
+        stale = [job for job in dict.fromkeys(jobs) if not self._is_valid(*job)]
+        if not stale:
+            return
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                compiled = list(tqdm(executor.map(compile_ground_truth, stale, chunksize=4), total=len(stale)))
+        else:
+            compiled = [compile_ground_truth(job) for job in tqdm(stale)]
+        for gt_file, entry in compiled:
+            if entry is None:
+                self.entries.pop(gt_file, None)
+            else:
+                self.entries[gt_file] = entry
+        self.save()
+
+    def get(self, gt_file):
+        entry = self.entries.get(gt_file)
+        return entry['values'] if entry is not None else None
+
+    def save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(self.entries, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments for evaluation.")
     
@@ -195,29 +455,68 @@ def parse_option():
     parser.add_argument('--setting', type=str, default='single',
         help='four setting: single, multi_react_exec, multi_row_exec, multi_row_react_exec')
     parser.add_argument('--dataset', type=str, default="all_data_912", help='dataset name')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for comparing workbooks')
+    parser.add_argument('--gt_cache', type=str, default=None, help='path of the precompiled ground-truth store, defaults to <dataset>/gt_cache.pkl')
+    parser.add_argument('--no_gt_cache', action='store_true', help='parse the ground-truth workbooks on every run')
 
     opt = parser.parse_args()
 
     return opt
 
 
+def evaluate_test_case(job):
+    """ Compare one (task, test case) pair, return the result and the time spent """
+    gt_path, proc_path, instruction_type, answer_position, gt_values = job
+    start = time.perf_counter()
+    try:
+        result, _ = compare_workbooks(gt_path, proc_path, instruction_type, answer_position, gt_values)
+    except:
+        result = False
+    return int(result), time.perf_counter() - start
+
+
 def evaluation(opt):
     dataset_path = os.path.abspath(f'../data/{opt.dataset}')
     with open(f'{dataset_path}/dataset.json', 'r') as fp:
         dataset = json.load(fp)
 
-    eval_results = []
-    for data in tqdm(dataset):
-        test_case_results = []
+    # Each answer_position is parsed once per dataset, workers receive the compiled plan
+    plans = {}
+    for data in dataset:
+        try:
+            plans[data['id']] = compile_answer_position(data['answer_position'])
+        except Exception:
+            # malformed positions fail inside compare_workbooks as before
+            plans[data['id']] = data['answer_position']
+
+    jobs = []
+    for data in dataset:
         for test_case_idx in range(3):
             gt_path = f"{dataset_path}/spreadsheet/{data['id']}/{test_case_idx + 1}_{data['id']}_answer.xlsx"
             proc_path = f"{dataset_path}/spreadsheet/{data['id']}/{test_case_idx + 1}_{data['id']}_input.xlsx"
             # proc_path = f"{dataset_path}/outputs/{opt.setting}_{opt.model}/{test_case_idx + 1}_{data['id']}_output.xlsx"
-            try:
-                result, _ = compare_workbooks(gt_path, proc_path, data['instruction_type'], data['answer_position'])
-            except:
-                result = False
-            test_case_results.append(int(result))
+            jobs.append((gt_path, proc_path, data['instruction_type'], plans[data['id']]))
+
+    # Ground truth is compiled once and reused across models, only the outputs are parsed
+    if opt.no_gt_cache:
+        jobs = [job + (None,) for job in jobs]
+    else:
+        store = GroundTruthStore(opt.gt_cache or f'{dataset_path}/gt_cache.pkl')
+        store.compile([(gt_path, answer_position) for gt_path, _, _, answer_position in jobs], opt.workers)
+        jobs = [job + (store.get(job[0]),) for job in jobs]
+
+    # (task, test case) pairs are spread across processes, results keep the job order
+    if opt.workers > 1:
+        with ProcessPoolExecutor(max_workers=opt.workers) as executor:
+            job_results = list(tqdm(executor.map(evaluate_test_case, jobs, chunksize=4), total=len(jobs)))
+    else:
+        job_results = [evaluate_test_case(job) for job in tqdm(jobs)]
+
+    eval_results = []
+    timings = []
+    for task_idx, data in enumerate(dataset):
+        task_job_results = job_results[task_idx * 3:(task_idx + 1) * 3]
+        test_case_results = [result for result, _ in task_job_results]
         soft_restriction = test_case_results.count(1) / len(test_case_results)
         hard_restriction = 0 if 0 in test_case_results else 1
         eval_results.append({
@@ -227,9 +526,21 @@ def evaluation(opt):
             'soft_restriction': soft_restriction,
             'hard_restriction': hard_restriction,
         })
-    
+        timings.append({
+            'id': data['id'],
+            'test_case_seconds': [round(seconds, 4) for _, seconds in task_job_results],
+            'total_seconds': round(sum(seconds for _, seconds in task_job_results), 4),
+        })
+
     with open(f'../outputs/eval_{opt.setting}_{opt.model}.json', 'w') as fp:
         json.dump(eval_results, fp, indent=4)
+    with open(f'../outputs/eval_{opt.setting}_{opt.model}_timing.json', 'w') as fp:
+        json.dump(timings, fp, indent=4)
+
+    slowest = sorted(timings, key=lambda t: t['total_seconds'], reverse=True)[:5]
+    print(f"Compared {len(jobs)} test cases in {sum(t['total_seconds'] for t in timings):.1f}s of worker time")
+    for t in slowest:
+        print(f"  {t['id']}: {t['total_seconds']:.2f}s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""
+子进程批量执行器 - 不经过 Jupyter，直接在带资源限制的子进程中运行完整脚本
+复用 fork 服务器：重型库只在服务器中导入一次，每个脚本在一个新 fork 的子进程中运行，
+子进程设置 CPU 时间、地址空间和打开文件数限制，stdout 与 stderr 分别捕获
+
+Subprocess batch executor - runs whole scripts in rlimited child processes without Jupyter
+Reuses the fork server: heavy libraries are imported once in the server and every script
+runs in a freshly forked child with CPU, address-space and open-file limits; stdout and
+stderr are captured separately
+"""
+import os
+import time
+import signal
+import socket
+
+from execution_result import ExecutionResult
+from fork_server import KILL_GRACE, get_fork_server, send_msg, recv_msg
+
+# 批量执行器配置（环境变量）
+# BATCH_EXEC_MEM_LIMIT_MB: 地址空间上限（MB），0 表示不限制
+# BATCH_EXEC_NOFILE_LIMIT: 打开文件数上限，0 表示不限制
+BATCH_EXEC_MEM_LIMIT_MB = int(os.environ.get("BATCH_EXEC_MEM_LIMIT_MB", "4096"))
+BATCH_EXEC_NOFILE_LIMIT = int(os.environ.get("BATCH_EXEC_NOFILE_LIMIT", "256"))
+
+
+class SubprocessExecutor:
+    """
+    一次性脚本执行器，每次 run 使用一个全新的子进程，执行完毕后子进程退出
+    线程之间可以各自持有一个实例并行执行
+    """
+
+    def __init__(self, mem_limit_mb: int = BATCH_EXEC_MEM_LIMIT_MB,
+                 nofile_limit: int = BATCH_EXEC_NOFILE_LIMIT):
+        """
+        参数:
+            mem_limit_mb: 子进程的地址空间上限（MB），0 表示不限制
+            nofile_limit: 子进程的打开文件数上限，0 表示不限制
+        """
+        self.mem_limit = mem_limit_mb * 1024 * 1024 if mem_limit_mb else None
+        self.nofile_limit = nofile_limit or None
+
+    def run(self, code: str, timeout: int = 60) -> ExecutionResult:
+        """
+        在新的子进程中运行脚本
+
+        参数:
+            code: 脚本源码
+            timeout: 墙钟超时（秒），CPU 时间上限为 timeout + KILL_GRACE
+
+        返回:
+            ExecutionResult，execution_time 为包含 fork 在内的墙钟时间；
+            子进程被系统结束（如超出资源限制）时 status 为 failed
+        """
+        start = time.monotonic()
+        conn, pid = get_fork_server().open_session(
+            self.mem_limit, cpu_limit=timeout + KILL_GRACE, nofile_limit=self.nofile_limit)
+        try:
+            conn.settimeout(timeout + KILL_GRACE)
+            send_msg(conn, {'code': code, 'timeout': timeout})
+            reply = recv_msg(conn)
+            if reply is None:
+                result = ExecutionResult.failed("process exited unexpectedly")
+            else:
+                result = ExecutionResult.from_dict(reply)
+        except socket.timeout:
+            # 子进程未能在宽限时间内响应
+            result = ExecutionResult.timeout(timeout)
+        except OSError as e:
+            result = ExecutionResult.failed(str(e))
+        finally:
+            conn.close()
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        result.execution_time = time.monotonic() - start
+        return result
@@ -0,0 +1,102 @@
+"""
+断点续跑 - JSONL 结果文件的读取与安全追加
+Checkpointing - reading and crash-safe appending of JSONL result files
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Set
+
+_append_lock = threading.Lock()
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """
+    读取 JSONL 结果文件
+
+    进程被强制结束时最后一行可能只写了一半，这里会把文件截断到最后一个完整行，
+    保证后续追加的记录不会与残缺行拼接在一起
+
+    参数:
+        path: JSONL 文件路径
+
+    返回:
+        记录列表，文件不存在时为空列表
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    complete = data[:data.rfind(b'\n') + 1]
+    if len(complete) != len(data):
+        logging.warning(f"Truncating partial record at the end of {path}")
+        with open(path, 'r+b') as fp:
+            fp.truncate(len(complete))
+    records = []
+    for line in complete.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            logging.warning(f"Skipping malformed record in {path}")
+    return records
+
+
+def load_completed_ids(path: str, is_done: Callable[[Dict[str, Any]], bool] = None) -> Set[Any]:
+    """
+    读取结果文件并返回已完成的任务ID集合
+
+    参数:
+        path: JSONL 文件路径
+        is_done: 判断记录是否算完成，默认所有记录都算完成
+    """
+    return {r['id'] for r in load_records(path) if is_done is None or is_done(r)}
+
+
+def append_jsonl(path: str, record: Dict[str, Any]):
+    """追加一条记录并 fsync，进程被 kill -9 时最多丢失尚未写入的记录"""
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _append_lock:
+        with open(path, 'a') as fp:
+            fp.write(line)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+
+def sort_jsonl(path: str, key: Callable[[Dict[str, Any]], Hashable]):
+    """
+    按 key 重写结果文件（稳定排序），使并发运行结束后的文件顺序与串行运行一致
+
+    运行过程中记录按完成顺序追加并 fsync，结束后再整体排序：先写临时文件并 fsync，
+    再用 os.replace 原子替换，任何时刻被结束都不会留下残缺的结果文件
+
+    参数:
+        path: JSONL 文件路径
+        key: 排序键，如数据集中的位置
+    """
+    records = load_records(path)
+    if not records:
+        return
+    records.sort(key=key)
+    with _append_lock:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            with os.fdopen(fd, 'w') as fp:
+                for record in records:
+                    fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def dataset_order(ids: List[Any]) -> Callable[[Dict[str, Any]], int]:
+    """sort_jsonl 的排序键：记录按 id 在数据集中的位置排序，未知 id 排在最后"""
+    position = {task_id: idx for idx, task_id in enumerate(ids)}
+    return lambda record: position.get(record.get('id'), len(position))
@@ -7,9 +7,14 @@ import os
 # 检查是否启用本地执行模式
 # 设置环境变量 USE_LOCAL_KERNEL=1 可启用本地模式，无需 Docker
 USE_LOCAL_KERNEL = os.environ.get("USE_LOCAL_KERNEL", "0").lower() == "1"
+# 本地模式下的执行后端: jupyter（本地 Jupyter 内核，默认）或 fork（fork 服务器）
+LOCAL_EXEC_BACKEND = os.environ.get("LOCAL_EXEC_BACKEND", "jupyter").lower()
 
 if USE_LOCAL_KERNEL:
-    from local_kernel import get_local_kernel_client
+    if LOCAL_EXEC_BACKEND == "fork":
+        from fork_server import ForkServerClient
+    else:
+        from local_kernel import LocalKernelManager, get_local_kernel_client
 else:
     from jupyter_kernel_cli import ClientJupyterKernel
 
@@ -27,9 +32,13 @@ def get_exec_client(url, conv_id):
 
     说明:
         - USE_LOCAL_KERNEL=1: 使用本地 Jupyter 内核，无需 Docker
+        - USE_LOCAL_KERNEL=1 且 LOCAL_EXEC_BACKEND=fork: 使用本地 fork 服务器，每个会话一个子进程
         - USE_LOCAL_KERNEL=0: 使用 HTTP 客户端连接 Docker 执行服务
     """
-    if USE_LOCAL_KERNEL:
+    if USE_LOCAL_KERNEL and LOCAL_EXEC_BACKEND == "fork":
+        # 本地 fork 模式：从预先导入依赖的服务器进程 fork 会话子进程
+        client = ForkServerClient(conv_id)
+    elif USE_LOCAL_KERNEL:
         # 本地模式：直接使用本地 Jupyter 内核
         client = get_local_kernel_client(conv_id)
         print(f"Using local kernel for execution (conv_id={conv_id})")
@@ -38,6 +47,28 @@ def get_exec_client(url, conv_id):
         client = ClientJupyterKernel(url, conv_id)
     return client
 
+def prewarm_exec_clients(count):
+    """
+    在提交任务之前预热执行后端：本地 Jupyter 模式下内核池在后台并行启动 count 个内核，
+    其他模式的会话按需创建，无需预热
+    """
+    if USE_LOCAL_KERNEL and LOCAL_EXEC_BACKEND != "fork":
+        LocalKernelManager.prewarm(count)
+
+def reset_exec_client(client):
+    """
+    在任务之间重置执行会话，清空上一个任务遗留的变量和文件句柄
+
+    不支持重置的客户端直接跳过
+    """
+    reset = getattr(client, 'reset', None)
+    if reset is None:
+        return
+    try:
+        reset()
+    except Exception as e:
+        print(f"Failed to reset execution session: {e}")
+
 def extract_code(response):
     if response.find('```python') != -1:
         code = response[response.find('```python') + len('```python'):]
@@ -47,19 +78,8 @@ def extract_code(response):
     return code
 
 def exec_code(client, code):
-    res = client.execute(code)
-    if res.find('-----') != -1:
-        tracebacks = res.split('\n\n\n\n')
-        error_feedback = ''
-        for t in tracebacks:
-            if t.find('Error') != -1:
-                error_feedback += t + '\n'
-                break
-        for t in tracebacks:
-            if len(t) >= len('Cell') and t[:len('Cell')] == 'Cell':
-                error_feedback += t
-                break
-        error_feedback += tracebacks[-1]
-        return error_feedback
-    else:
-        return res
+    """
+    执行代码并返回发给模型的结果：出错时只反馈精简的错误信息（错误标题、出错单元格、最后一帧），
+    图片替换为说明，超出输出预算的部分省略（见 execution_result.OUTPUT_BUDGET_CHARS）
+    """
+    return client.run(code).render()
@@ -0,0 +1,139 @@
+"""
+多轮对话上下文管理 - 按 token 预算压缩较早的代码执行结果
+使用模型的 tokenizer 统计 token 数（不可用时按字符数估算）；超出预算时把较早的执行结果替换为摘要，
+已压缩的消息不再变化，提示词前缀保持逐字节稳定，vLLM 的前缀缓存可以持续命中
+
+Multi-turn context manager - compacts older execution results under a token budget
+Tokens are counted with the model's tokenizer (estimated from characters when unavailable);
+once over budget, older execution results are replaced by summaries. Compacted messages never
+change again, so the prompt prefix stays byte-stable and vLLM prefix caching keeps hitting
+"""
+import logging
+import threading
+from typing import Dict, List, Optional
+
+try:
+    from transformers import AutoTokenizer
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+# 没有 tokenizer 时按每个 token 约 4 个字符估算
+CHARS_PER_TOKEN = 4
+# 摘要中保留的执行结果开头行数与每行字符数
+SUMMARY_HEAD_LINES = 3
+SUMMARY_LINE_CHARS = 200
+# 最近的若干条执行结果始终保留原文
+DEFAULT_KEEP_RECENT = 1
+
+
+class TokenCounter:
+    """
+    token 计数器
+    优先加载模型的 tokenizer，加载失败（如模型只能通过 API 访问）时按字符数估算
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        """
+        参数:
+            tokenizer_name: tokenizer 名称或本地路径，通常与 --model 相同
+        """
+        self.tokenizer = None
+        if tokenizer_name and TRANSFORMERS_AVAILABLE:
+            try:
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                logging.warning(f"Failed to load tokenizer {tokenizer_name}, estimating tokens from characters: {e}")
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+_counters: Dict[Optional[str], TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(tokenizer_name: Optional[str]) -> TokenCounter:
+    """获取进程内共享的 token 计数器，同名 tokenizer 只加载一次"""
+    with _counters_lock:
+        if tokenizer_name not in _counters:
+            _counters[tokenizer_name] = TokenCounter(tokenizer_name)
+        return _counters[tokenizer_name]
+
+
+def summarize_observation(text: str, num_tokens: int) -> str:
+    """
+    生成执行结果的摘要：保留开头几行和最后一行（报错信息通常在最后一行）
+
+    摘要只由原文决定，同一条执行结果每次得到相同的摘要
+    """
+    lines = [line[:SUMMARY_LINE_CHARS] for line in text.splitlines()]
+    if len(lines) > SUMMARY_HEAD_LINES + 1:
+        lines = lines[:SUMMARY_HEAD_LINES] + ['...', lines[-1]]
+    return '\n'.join(lines) + f"\n[Earlier execution output compacted, originally {num_tokens} tokens]"
+
+
+class ConversationManager:
+    """
+    多轮对话的上下文管理器
+
+    messages 按 用户 / 模型 交替排列：第 0 条是提示词，之后模型回复与执行结果交替出现。
+    只压缩执行结果，提示词和模型回复（包含代码）保持原样；
+    history 保存完整的原始对话，用于写入结果文件
+    """
+
+    def __init__(self, prompt: str, counter: Optional[TokenCounter] = None, budget: int = 0,
+                 keep_recent: int = DEFAULT_KEEP_RECENT):
+        """
+        参数:
+            prompt: 第一轮的提示词
+            counter: token 计数器，budget 为 0 时可以为空
+            budget: 发给模型的上下文 token 预算，0 表示不压缩
+            keep_recent: 始终保留原文的最近执行结果条数
+        """
+        self.counter = counter
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.history: List[str] = []
+        self.messages: List[str] = []
+        self.tokens: List[int] = []
+        self.compacted = 0
+        self._append(prompt)
+
+    def _append(self, text: str):
+        self.history.append(text)
+        self.messages.append(text)
+        self.tokens.append(self.counter.count(text) if self.budget else 0)
+
+    def add_response(self, response: str):
+        """追加模型回复"""
+        self._append(response)
+
+    def add_observation(self, observation: str):
+        """追加代码执行结果，超出预算时压缩较早的执行结果"""
+        self._append(observation)
+        if self.budget and self.num_tokens > self.budget:
+            self._compact()
+
+    @property
+    def num_tokens(self) -> int:
+        return sum(self.tokens)
+
+    def _compact(self):
+        """
+        一次性压缩除最近 keep_recent 条以外的所有未压缩执行结果
+
+        压缩是单调的：已压缩的消息不再改变，提示词前缀只在压缩发生时变化一次，
+        而不是每一轮都变化
+        """
+        observations = list(range(2, len(self.messages), 2))
+        if self.keep_recent:
+            observations = observations[:-self.keep_recent]
+        for idx in observations[self.compacted:]:
+            summary = summarize_observation(self.messages[idx], self.tokens[idx])
+            if len(summary) < len(self.messages[idx]):
+                self.messages[idx] = summary
+                self.tokens[idx] = self.counter.count(summary)
+        self.compacted = max(self.compacted, len(observations))
@@ -0,0 +1,136 @@
+"""
+磁盘缓存 - 内容寻址、大小受限的 LRU 缓存
+每个条目是一个 JSON 文件，写入通过临时文件 + 原子重命名完成，多进程并发写安全
+
+Disk cache - content-addressed, size-bounded LRU store
+Each entry is one JSON file written via temp file + atomic rename, safe for concurrent writers
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 下无文件锁，退化为进程内锁
+    fcntl = None
+
+
+def hash_key(obj: Any) -> str:
+    """将任意可 JSON 序列化的对象哈希为缓存键"""
+    payload = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """
+    基于目录的 LRU 缓存
+
+    条目按键的前两位分片存放；读取命中时刷新文件 mtime，
+    总大小超过上限时按 mtime 从旧到新淘汰，直到降到上限的 90%
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        """
+        参数:
+            root: 缓存目录
+            max_bytes: 缓存总大小上限（字节），None 表示不限制
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = self._scan_size() if max_bytes else 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for shard in os.listdir(self.root):
+            shard_path = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                if name.endswith('.json'):
+                    yield os.path.join(shard_path, name)
+
+    def _scan_size(self) -> int:
+        size = 0
+        for path in self._entries():
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存条目，不存在或已损坏时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fp:
+                value = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            # 刷新 mtime 作为 LRU 访问时间
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key: str, value: Any):
+        """写入缓存条目（原子替换）"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self.max_bytes:
+            with self._lock:
+                self._size += len(data)
+                if self._size > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """按 LRU 淘汰条目，使用目录级文件锁避免多个进程同时淘汰"""
+        lock_fp = open(os.path.join(self.root, '.lock'), 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            entries = []
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self._size = total
+            if removed:
+                logging.info(f"Disk cache {self.root}: evicted {removed} entries")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+            lock_fp.close()
@@ -0,0 +1,256 @@
+"""
+结构化执行结果 - 各执行后端统一返回的结果对象
+输出按到达顺序保存为 nbformat 风格的列表，错误以 ename / evalue / traceback 帧保存，
+旧的字符串形式（text）与发给模型的错误摘要都由这些字段生成，无需再扫描整段输出
+
+Structured execution result - the common result object of all execution backends
+Outputs are kept in arrival order as an nbformat-style list and errors as ename / evalue /
+traceback frames; the legacy string form (text) and the error summary sent to the model are
+both built from these fields instead of scanning the whole output
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+# 执行状态
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+# 执行环境本身出错（连接断开、进程被系统结束等），而不是用户代码报错
+STATUS_FAILED = 'failed'
+
+NO_OUTPUT_TEXT = "[Code executed successfully with no output]"
+
+# 输出预算配置（环境变量），作用于发给模型的执行结果
+# EXEC_OUTPUT_BUDGET_CHARS: 保留的字符数上限，超出部分保留开头和结尾、中间省略，0 表示不限制
+# EXEC_OUTPUT_IMAGES: 图片的处理方式，summary（替换为一行说明，默认）/ drop（丢弃）/ keep（保留 base64）
+OUTPUT_BUDGET_CHARS = int(os.environ.get("EXEC_OUTPUT_BUDGET_CHARS", "20000"))
+OUTPUT_IMAGES = os.environ.get("EXEC_OUTPUT_IMAGES", "summary").lower()
+# 预算内开头部分所占的比例，其余留给结尾（报错和最后的打印通常在结尾）
+HEAD_RATIO = 0.5
+
+
+def elide(text: str, budget: int) -> str:
+    """超出预算时保留开头和结尾，中间替换为省略标记"""
+    if not budget or len(text) <= budget:
+        return text
+    head = int(budget * HEAD_RATIO)
+    tail = budget - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n...[{omitted} characters omitted]...\n{text[len(text) - tail:]}"
+
+
+def _image_summary(mime: str, data: str) -> str:
+    # base64 每 4 个字符对应 3 个字节
+    return f"[{mime} image, {len(data) * 3 // 4 / 1024:.1f} KB, omitted]"
+
+
+class OutputBudgetStats:
+    """统计输出预算节省的上下文，线程安全"""
+
+    def __init__(self):
+        self.num_results = 0
+        self.num_elided = 0
+        self.num_images = 0
+        self.original_chars = 0
+        self.rendered_chars = 0
+        self._lock = threading.Lock()
+
+    def record(self, original: int, rendered: int, elided: bool, images: int):
+        with self._lock:
+            self.num_results += 1
+            self.num_elided += int(elided)
+            self.num_images += images
+            self.original_chars += original
+            self.rendered_chars += rendered
+
+
+output_budget_stats = OutputBudgetStats()
+
+
+def log_output_stats():
+    """打印输出预算的统计信息"""
+    stats = output_budget_stats
+    if not stats.num_results:
+        return
+    saved = stats.original_chars - stats.rendered_chars
+    print(f"Execution output budget: {stats.num_results} results, {stats.num_elided} elided, "
+          f"{stats.num_images} images summarized or dropped, "
+          f"{stats.original_chars} -> {stats.rendered_chars} chars ({saved} saved)")
+
+
+class ExecutionResult:
+    """
+    一次代码执行的结构化结果
+
+    属性:
+        status: ok / error / timeout / failed
+        outputs: [{'output_type': 'stream', 'name': 'stdout' | 'stderr', 'text': ...}
+                  或 {'output_type': 'execute_result' | 'display_data', 'data': {mime: ...}}]
+        ename / evalue / traceback: 错误类型、错误信息、回溯帧列表（已去除 ANSI 转义）
+        execution_time: 执行耗时（秒）
+        message: 执行环境给出的附加说明，如超时或输出截断提示
+    """
+
+    def __init__(self, status: str = STATUS_OK, outputs: Optional[List[Dict[str, Any]]] = None,
+                 ename: str = '', evalue: str = '', traceback: Optional[List[str]] = None,
+                 execution_time: float = 0.0, message: str = ''):
+        self.status = status
+        self.outputs = outputs if outputs is not None else []
+        self.ename = ename
+        self.evalue = evalue
+        self.traceback = traceback if traceback is not None else []
+        self.execution_time = execution_time
+        self.message = message
+        # render 之后记录：原始输出与发给模型的输出的字符数
+        self.original_size = None
+        self.rendered_size = None
+
+    def add_stream(self, name: str, text: str):
+        """追加一段流输出，与上一段同名流输出相邻时合并"""
+        if self.outputs and self.outputs[-1]['output_type'] == 'stream' and self.outputs[-1]['name'] == name:
+            self.outputs[-1]['text'] += text
+        else:
+            self.outputs.append({'output_type': 'stream', 'name': name, 'text': text})
+
+    def add_data(self, output_type: str, data: Dict[str, Any]):
+        """追加一个富输出（execute_result / display_data）"""
+        self.outputs.append({'output_type': output_type, 'data': data})
+
+    def set_error(self, ename: str, evalue: str, traceback: List[str]):
+        self.status = STATUS_ERROR
+        self.ename = ename
+        self.evalue = evalue
+        self.traceback = traceback
+
+    def _stream(self, name: str) -> str:
+        return ''.join(o['text'] for o in self.outputs if o['output_type'] == 'stream' and o['name'] == name)
+
+    @property
+    def stdout(self) -> str:
+        return self._stream('stdout')
+
+    @property
+    def stderr(self) -> str:
+        return self._stream('stderr')
+
+    @property
+    def rich_outputs(self) -> List[Dict[str, Any]]:
+        return [o for o in self.outputs if o['output_type'] != 'stream']
+
+    def _render(self, images: str = 'keep') -> str:
+        if self.status in (STATUS_TIMEOUT, STATUS_FAILED):
+            return self.message
+        parts = []
+        for output in self.outputs:
+            if output['output_type'] == 'stream':
+                parts.append(output['text'])
+                continue
+            data = output['data']
+            if 'text/plain' in data:
+                parts.append(data['text/plain'])
+            if 'image/png' in data:
+                if images == 'keep':
+                    parts.append(f"![image](data:image/png;base64,{data['image/png']})")
+                elif images == 'summary':
+                    parts.append(_image_summary('image/png', data['image/png']))
+        if self.message:
+            parts.append(self.message)
+        if self.traceback:
+            parts.append('\n\n\n\n'.join(self.traceback))
+        if not parts:
+            return NO_OUTPUT_TEXT
+        return ''.join(parts)
+
+    @property
+    def text(self) -> str:
+        """与原先各后端返回的字符串一致：按顺序拼接输出，图片以 Markdown 内联，最后是错误回溯"""
+        return self._render()
+
+    @property
+    def num_images(self) -> int:
+        return sum(1 for o in self.rich_outputs if 'image/png' in o['data'])
+
+    def render(self, budget: int = None, images: str = None) -> str:
+        """
+        生成发给模型的输出：图片按 images 处理，超出 budget 时保留开头和结尾，
+        出错时只保留精简的错误信息；原始与输出的字符数记录在 original_size / rendered_size
+
+        参数:
+            budget: 字符数上限，默认 EXEC_OUTPUT_BUDGET_CHARS，0 表示不限制
+            images: summary / drop / keep，默认 EXEC_OUTPUT_IMAGES
+        """
+        budget = OUTPUT_BUDGET_CHARS if budget is None else budget
+        images = OUTPUT_IMAGES if images is None else images
+        if self.status == STATUS_ERROR:
+            rendered = self.error_summary()
+        else:
+            rendered = self._render(images)
+        elided = elide(rendered, budget)
+
+        self.original_size = len(self.text)
+        self.rendered_size = len(elided)
+        output_budget_stats.record(self.original_size, self.rendered_size, elided is not rendered,
+                                   self.num_images if images != 'keep' else 0)
+        return elided
+
+    def error_summary(self) -> str:
+        """
+        发给模型的精简错误信息：错误标题帧、出错的代码单元帧和最后一帧
+        """
+        if self.status != STATUS_ERROR:
+            return self.text
+        if not self.traceback:
+            return f"{self.ename}: {self.evalue}"
+        summary = ''
+        for frame in self.traceback:
+            if frame.find('Error') != -1:
+                summary += frame + '\n'
+                break
+        for frame in self.traceback:
+            if frame.startswith('Cell'):
+                summary += frame
+                break
+        return summary + self.traceback[-1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'status': self.status,
+            'outputs': self.outputs,
+            'ename': self.ename,
+            'evalue': self.evalue,
+            'traceback': self.traceback,
+            'execution_time': self.execution_time,
+            'message': self.message,
+            'original_size': self.original_size,
+            'rendered_size': self.rendered_size,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ExecutionResult':
+        result = cls(
+            status=data.get('status', STATUS_OK),
+            outputs=data.get('outputs'),
+            ename=data.get('ename', ''),
+            evalue=data.get('evalue', ''),
+            traceback=data.get('traceback'),
+            execution_time=data.get('execution_time', 0.0),
+            message=data.get('message', ''),
+        )
+        result.original_size = data.get('original_size')
+        result.rendered_size = data.get('rendered_size')
+        return result
+
+    @classmethod
+    def timeout(cls, timeout: float, execution_time: float = 0.0) -> 'ExecutionResult':
+        return cls(status=STATUS_TIMEOUT, execution_time=execution_time,
+                   message=f"[Execution timed out ({timeout} seconds).]")
+
+    @classmethod
+    def failed(cls, reason: str, execution_time: float = 0.0) -> 'ExecutionResult':
+        return cls(status=STATUS_FAILED, execution_time=execution_time,
+                   message=f"[Execution error: {reason}]")
+
+    def __repr__(self):
+        return (f"ExecutionResult(status={self.status!r}, outputs={len(self.outputs)}, "
+                f"ename={self.ename!r}, execution_time={self.execution_time:.3f})")
@@ -0,0 +1,452 @@
+"""
+Fork 服务器执行后端 - 预先导入重型库，每个会话 fork 一个写时复制子进程
+无需 Jupyter / ZMQ，新会话启动耗时为一次 fork
+
+Fork-server execution backend - imports heavy libraries once, then forks a
+copy-on-write child per session. No Jupyter/ZMQ; a new session costs one fork.
+
+协议 / Protocol:
+    每个 unix socket 连接对应一个会话，服务器 accept 后 fork 子进程处理该连接。
+    消息为 4 字节大端长度前缀 + UTF-8 JSON。
+    Each unix-socket connection is one session; the server forks a child per accepted
+    connection. Messages are a 4-byte big-endian length prefix followed by UTF-8 JSON.
+"""
+import os
+import io
+import ast
+import sys
+import json
+import time
+import atexit
+import signal
+import inspect
+import socket
+import struct
+import logging
+import argparse
+import linecache
+import tempfile
+import textwrap
+import importlib
+import threading
+import subprocess
+import contextlib
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from execution_result import ExecutionResult
+
+try:
+    import resource
+except ImportError:  # 非 POSIX 平台不支持资源限制
+    resource = None
+
+# Fork 服务器配置（环境变量）
+# FORK_SERVER_TIMEOUT: 单次执行超时（秒）
+# FORK_SERVER_MEM_LIMIT_MB: 每个会话子进程的地址空间上限（MB），0 表示不限制
+FORK_SERVER_TIMEOUT = int(os.environ.get("FORK_SERVER_TIMEOUT", "60"))
+FORK_SERVER_MEM_LIMIT_MB = int(os.environ.get("FORK_SERVER_MEM_LIMIT_MB", "4096"))
+
+# 服务器启动时预先导入的模块
+PRELOAD_MODULES = ("pandas", "numpy", "openpyxl")
+
+# 超时后等待子进程自行返回的宽限时间（秒），之后强制结束
+KILL_GRACE = 5
+
+TRACEBACK_RULE = "-" * 75
+# 回溯中行号列的宽度，以及出错行之前显示的上下文行数
+TRACEBACK_NUMBER_WIDTH = 7
+TRACEBACK_CONTEXT = 2
+
+
+def send_msg(sock: socket.socket, obj: Dict[str, Any]):
+    data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_msg(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """接收一条消息，连接关闭时返回 None"""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    data = _recv_exact(sock, struct.unpack('>I', header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def apply_limits(mem_limit: Optional[int] = None, cpu_limit: Optional[int] = None,
+                 nofile_limit: Optional[int] = None):
+    """
+    在当前进程上设置资源限制
+
+    参数:
+        mem_limit: 地址空间上限（字节）
+        cpu_limit: CPU 时间上限（秒）
+        nofile_limit: 打开文件数上限
+    """
+    if resource is None:
+        return
+    limits = (
+        (resource.RLIMIT_AS, mem_limit),
+        (resource.RLIMIT_CPU, cpu_limit),
+        (resource.RLIMIT_NOFILE, nofile_limit),
+    )
+    for kind, value in limits:
+        if not value:
+            continue
+        _, hard = resource.getrlimit(kind)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(kind, (value, hard))
+
+
+def _source_lines(lines: List[str], lineno: int) -> str:
+    """按 IPython 的样式渲染出错行及其前两行（去除共同缩进），出错行以箭头标出，每行以换行结尾"""
+    numbers = range(max(1, lineno - TRACEBACK_CONTEXT), lineno + 1)
+    snippet = textwrap.dedent('\n'.join(lines[no - 1] if no <= len(lines) else '' for no in numbers)).split('\n')
+    rendered = ''
+    for no, line in zip(numbers, snippet):
+        if no == lineno:
+            marker = '-' * (TRACEBACK_NUMBER_WIDTH - len(str(no)) - 2) + '> ' + str(no)
+        else:
+            marker = str(no).rjust(TRACEBACK_NUMBER_WIDTH)
+        rendered += f"{marker} {line}\n"
+    return rendered
+
+
+def traceback_frames(exc: BaseException, cells: Dict[str, str]) -> List[str]:
+    """
+    按 IPython 的格式渲染异常回溯的各帧，与 Jupyter 内核 error 消息中的 traceback 一致：
+    分隔线和标题各占一帧，代码帧以换行结尾，最后一帧为 "异常名: 异常信息"
+
+    参数:
+        exc: 异常对象
+        cells: 单元格文件名到源码的映射，用于显示出错行
+    """
+    ename = type(exc).__name__
+    parts = [TRACEBACK_RULE, ename + "Traceback (most recent call last)".rjust(len(TRACEBACK_RULE) - len(ename))]
+    frames = list(traceback.walk_tb(exc.__traceback__))
+    # 跳过执行器自身的栈帧
+    while frames and frames[0][0].f_code.co_filename == __file__:
+        frames = frames[1:]
+    for frame, lineno in frames:
+        code = frame.f_code
+        scope = ''
+        if code.co_name != '<module>':
+            args = inspect.formatargvalues(*inspect.getargvalues(frame), formatvalue=lambda value: '')
+            scope = f", in {getattr(code, 'co_qualname', code.co_name)}{args}"
+        if code.co_filename in cells:
+            cell_no = code.co_filename[len('<cell-'):-1]
+            lines = cells[code.co_filename].splitlines()
+            parts.append(f"Cell In[{cell_no}], line {lineno}{scope}\n" + _source_lines(lines, lineno))
+        else:
+            lines = [line.rstrip('\n') for line in linecache.getlines(code.co_filename)]
+            filename = code.co_filename.replace(os.path.expanduser('~'), '~', 1)
+            parts.append(f"File {filename}:{lineno}{scope}\n" + _source_lines(lines, lineno))
+    evalue = str(exc)
+    parts.append(f"{ename}: {evalue}" if evalue else ename)
+    return parts
+
+
+class _StreamWriter(io.TextIOBase):
+    """把 print 的输出按流名称追加到 ExecutionResult，保留 stdout/stderr 的先后顺序"""
+
+    def __init__(self, result: ExecutionResult, name: str):
+        self.result = result
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            self.result.add_stream(self.name, text)
+        return len(text)
+
+
+class _CellTimeout(BaseException):
+    """单元格执行超时（继承 BaseException，避免被用户代码的 except Exception 吞掉）"""
+
+
+def _raise_timeout(signum, frame):
+    raise _CellTimeout()
+
+
+class Session:
+    """
+    子进程中的执行会话，保存跨单元格的命名空间
+    """
+
+    def __init__(self):
+        self.namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+        self.cells: Dict[str, str] = {}
+        self.count = 0
+
+    def run(self, code: str, timeout: int) -> ExecutionResult:
+        """执行一个单元格，分别捕获 stdout / stderr、最后表达式的值以及错误回溯"""
+        self.count += 1
+        filename = f"<cell-{self.count}>"
+        self.cells[filename] = code
+        result = ExecutionResult()
+        start = time.monotonic()
+
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            with contextlib.redirect_stdout(_StreamWriter(result, 'stdout')), \
+                    contextlib.redirect_stderr(_StreamWriter(result, 'stderr')):
+                tree = ast.parse(code, filename=filename)
+                last_expr = None
+                if tree.body and isinstance(tree.body[-1], ast.Expr):
+                    last_expr = ast.Expression(tree.body.pop().value)
+                exec(compile(tree, filename, 'exec'), self.namespace)
+                if last_expr is not None:
+                    value = eval(compile(last_expr, filename, 'eval'), self.namespace)
+                    if value is not None:
+                        result.add_data('execute_result', {'text/plain': repr(value)})
+        except _CellTimeout:
+            timed_out = ExecutionResult.timeout(timeout)
+            timed_out.outputs = result.outputs
+            result = timed_out
+        except BaseException as e:
+            result.set_error(type(e).__name__, str(e), traceback_frames(e, self.cells))
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+        result.execution_time = time.monotonic() - start
+        return result
+
+
+def _serve_session(conn: socket.socket):
+    """子进程入口：处理一个会话的全部请求，连接关闭后退出"""
+    hello = recv_msg(conn)
+    if hello is None:
+        return
+    apply_limits(mem_limit=hello.get('mem_limit'), cpu_limit=hello.get('cpu_limit'),
+                 nofile_limit=hello.get('nofile_limit'))
+    send_msg(conn, {'pid': os.getpid()})
+
+    session = Session()
+    while True:
+        request = recv_msg(conn)
+        if request is None:
+            return
+        result = session.run(request['code'], request.get('timeout', FORK_SERVER_TIMEOUT))
+        send_msg(conn, result.to_dict())
+
+
+def serve(socket_path: str, parent_pid: Optional[int] = None, preload=PRELOAD_MODULES):
+    """
+    服务器主循环：预先导入模块，然后为每个连接 fork 一个会话子进程
+
+    参数:
+        socket_path: unix socket 路径
+        parent_pid: 父进程 PID，父进程退出后服务器随之退出
+        preload: 预先导入的模块
+    """
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logging.warning(f"Fork server could not preload {name}")
+
+    # 子进程退出后自动回收
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    # 先绑定到临时路径，listen 之后再改名，客户端看到 socket 文件时即可连接
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path + '.tmp')
+    server.listen(128)
+    os.rename(socket_path + '.tmp', socket_path)
+    server.settimeout(1.0)
+    try:
+        while True:
+            if parent_pid is not None and os.getppid() != parent_pid:
+                return
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                try:
+                    _serve_session(conn)
+                finally:
+                    os._exit(0)
+            conn.close()
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class ForkServer:
+    """
+    Fork 服务器进程的句柄（客户端侧）
+    """
+
+    def __init__(self, preload=PRELOAD_MODULES):
+        self.preload = preload
+        self.socket_path = os.path.join(tempfile.mkdtemp(prefix='fork-server-'), 'server.sock')
+        self.process = None
+        self._lock = threading.Lock()
+
+    def start(self, timeout: int = 60):
+        """启动服务器进程并等待 socket 就绪"""
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+            cmd = [sys.executable, os.path.abspath(__file__), '--socket', self.socket_path,
+                   '--parent_pid', str(os.getpid()), '--preload', ','.join(self.preload)]
+            self.process = subprocess.Popen(cmd)
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(self.socket_path):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("Failed to start fork server")
+                time.sleep(0.05)
+            logging.info(f"Fork server started at {self.socket_path}")
+
+    def open_session(self, mem_limit: Optional[int], cpu_limit: Optional[int] = None,
+                     nofile_limit: Optional[int] = None) -> Tuple[socket.socket, int]:
+        """
+        打开一个新会话（服务器 fork 一个子进程）
+
+        参数:
+            mem_limit: 地址空间上限（字节）
+            cpu_limit: CPU 时间上限（秒）
+            nofile_limit: 打开文件数上限
+
+        返回:
+            (连接, 子进程 PID)
+        """
+        self.start()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.socket_path)
+        send_msg(conn, {'mem_limit': mem_limit, 'cpu_limit': cpu_limit, 'nofile_limit': nofile_limit})
+        reply = recv_msg(conn)
+        if reply is None:
+            conn.close()
+            raise RuntimeError("Fork server closed the session")
+        return conn, reply['pid']
+
+    def shutdown(self):
+        """关闭服务器进程"""
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+
+_server: Optional[ForkServer] = None
+_server_lock = threading.Lock()
+
+
+def get_fork_server() -> ForkServer:
+    """获取进程内共享的 fork 服务器"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ForkServer()
+            atexit.register(_server.shutdown)
+        return _server
+
+
+class ForkServerClient:
+    """
+    Fork 服务器客户端
+    与 LocalKernelClient / ClientJupyterKernel 接口兼容
+    """
+
+    def __init__(self, conv_id: str, timeout: int = FORK_SERVER_TIMEOUT,
+                 mem_limit_mb: int = FORK_SERVER_MEM_LIMIT_MB):
+        """
+        参数:
+            conv_id: 会话ID
+            timeout: 单次执行超时（秒）
+            mem_limit_mb: 会话子进程的地址空间上限（MB），0 表示不限制
+        """
+        self.conv_id = conv_id
+        self.timeout = timeout
+        self.mem_limit = mem_limit_mb * 1024 * 1024 if mem_limit_mb else None
+        self.conn = None
+        self.pid = None
+        print(f"ForkServerClient initialized with conv_id={conv_id}")
+
+    def _close_session(self, kill: bool = False):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if kill and self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.pid = None
+
+    def execute(self, code: str, timeout: int = None) -> str:
+        """执行代码并返回结果字符串"""
+        return self.run(code, timeout=timeout).text
+
+    def run(self, code: str, timeout: int = None) -> ExecutionResult:
+        """
+        执行代码并返回结构化结果
+
+        子进程内用定时器中断超时的单元格；若子进程在宽限时间内仍未返回，
+        则强制结束该子进程，下一次执行会自动开启新会话
+        """
+        timeout = timeout or self.timeout
+        start = time.monotonic()
+        if self.conn is None:
+            self.conn, self.pid = get_fork_server().open_session(self.mem_limit)
+        try:
+            self.conn.settimeout(timeout + KILL_GRACE)
+            send_msg(self.conn, {'code': code, 'timeout': timeout})
+            reply = recv_msg(self.conn)
+        except socket.timeout:
+            self._close_session(kill=True)
+            return ExecutionResult.timeout(timeout, time.monotonic() - start)
+        except OSError as e:
+            self._close_session(kill=True)
+            return ExecutionResult.failed(str(e), time.monotonic() - start)
+        if reply is None:
+            # 子进程异常退出（如超出内存限制被系统结束）
+            self._close_session()
+            return ExecutionResult.failed("session process exited unexpectedly", time.monotonic() - start)
+        return ExecutionResult.from_dict(reply)
+
+    def reset(self):
+        """结束当前会话子进程，下一次执行时重新 fork，得到全新的命名空间"""
+        self._close_session(kill=True)
+
+    def shutdown(self):
+        """关闭会话"""
+        self._close_session(kill=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("fork server for code execution.")
+    parser.add_argument('--socket', type=str, required=True, help='unix socket path')
+    parser.add_argument('--parent_pid', type=int, default=None, help='exit when this process exits')
+    parser.add_argument('--preload', type=str, default=','.join(PRELOAD_MODULES), help='modules imported before forking')
+    args = parser.parse_args()
+
+    serve(args.socket, args.parent_pid, [m for m in args.preload.split(',') if m])
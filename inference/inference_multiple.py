@@ -1,11 +1,16 @@
 import os
 import json
+import asyncio
 import argparse
-import pandas as pd
-from tqdm import tqdm
 
-from llm_api import get_llm_response
-from code_exec import get_exec_client, extract_code, exec_code
+from llm_api import aget_llm_response, add_llm_arguments, log_llm_stats
+from code_exec import extract_code, exec_code
+from task_scheduler import ExecClientPool, arun_tasks
+from execution_result import log_output_stats
+from spreadsheet_preview import build_preview, DEFAULT_PREVIEW_CACHE_DIR
+from checkpoint import load_completed_ids, append_jsonl, sort_jsonl, dataset_order
+from conversation import ConversationManager, get_token_counter
+from replay import replay_solutions, validate_replay_backend, DEFAULT_REPLAY_TIMEOUT, REPLAY_BACKENDS
 from prompt_format import PROMPT_FORMAT_SINGLE, PROMPT_DF_RCT_FORMAT , PROMPT_NO_DF_RCT_FORMAT
 
 # Check if local execution mode is enabled
@@ -13,22 +18,7 @@ USE_LOCAL_KERNEL = os.environ.get("USE_LOCAL_KERNEL", "0").lower() == "1"
 
 
 def gen_file_content(input_file):
-    excel_file = pd.ExcelFile(input_file)
-    sheet_names = excel_file.sheet_names
-    excel_data = {}
-
-    for sheet_name in sheet_names:
-        df = excel_file.parse(sheet_name)
-        len = opt.row if df.shape[0] > opt.row else df.shape[0]
-        excel_data[sheet_name] = df.head(len).to_string()
-
-    final_str = ""
-    for sheet_name, sheet_str in excel_data.items():
-        final_str += f"Sheet Name: {sheet_name}\n"
-        final_str += sheet_str + "\n"
-        final_str += "-" * 50 + "\n"
-    
-    return final_str
+    return build_preview(input_file, opt.row, opt.preview_cache_dir, opt.preview_full_sheet)
 
 
 def gen_solution(opt):
@@ -48,10 +38,22 @@ def gen_solution(opt):
         os.makedirs(model_output_path)
         os.chmod(model_output_path, 0o777)
 
-    # create code execution client
-    client = get_exec_client(opt.code_exec_url, opt.conv_id)
+    conv_path = f'outputs/conv_multi_{opt.setting}_{opt.model}.jsonl'
+    dataset_ids = [data['id'] for data in dataset]
+    if opt.resume:
+        # 只调度尚未完成的任务
+        completed_ids = load_completed_ids(conv_path)
+        dataset = [data for data in dataset if data['id'] not in completed_ids]
+        print(f"Resuming: {len(completed_ids)} tasks completed, {len(dataset)} remaining")
+
+    if opt.setting not in ('row_exec', 'react_exec', 'row_react_exec'):
+        print('Wrong multi-round setting.')
+        exit(0)
+
+    # 只有设置了上下文预算时才加载 tokenizer
+    counter = get_token_counter(opt.tokenizer or opt.model) if opt.context_budget else None
 
-    for data in tqdm(dataset):
+    async def solve(data, client):
         file_name = f"1_{data['spreadsheet_path'].lstrip('spreadsheet/')}_input.xlsx"
         find_input_path = f"{dataset_path}/{data['spreadsheet_path']}/{file_name}"
 
@@ -65,7 +67,8 @@ def gen_solution(opt):
 
         # three setting: row_exec, react_exec, row_react_exec
         if opt.setting == 'row_exec':
-            file_content = gen_file_content(find_input_path)
+            # 读表格与磁盘缓存会阻塞事件循环，放到线程中运行
+            file_content = await asyncio.to_thread(gen_file_content, find_input_path)
             prompt = PROMPT_FORMAT_SINGLE.format_map({
                 'instruction': data['instruction'],
                 'spreadsheet_path': input_path,
@@ -84,8 +87,9 @@ def gen_solution(opt):
                 'max_turn_num' : opt.max_turn_num,
                 'output_path': output_path
             })
-        elif opt.setting == 'row_react_exec':
-            file_content = gen_file_content(find_input_path)
+        else:
+            # 读表格与磁盘缓存会阻塞事件循环，放到线程中运行
+            file_content = await asyncio.to_thread(gen_file_content, find_input_path)
             prompt = PROMPT_DF_RCT_FORMAT.format_map({
                 'instruction': data['instruction'],
                 'spreadsheet_path': input_path,
@@ -95,43 +99,55 @@ def gen_solution(opt):
                 'max_turn_num' : opt.max_turn_num,
                 'output_path': output_path
             })
-        else:
-            print('Wrong multi-round setting.')
-            exit(0)
 
-        messages = [prompt]
-        for _ in tqdm(range(opt.max_turn_num)):
-            response = get_llm_response(messages, opt)
-            messages.append(response)
+        # 发给模型的是按预算压缩后的对话，结果文件中保存完整对话
+        # token 计数与压缩同样放到线程中，避免阻塞其他对话
+        conversation = await asyncio.to_thread(ConversationManager, prompt, counter, opt.context_budget)
+        for _ in range(opt.max_turn_num):
+            # 等待模型回复时让出事件循环，其他对话的请求可以同时发出
+            response = await aget_llm_response(conversation.messages, opt)
+            await asyncio.to_thread(conversation.add_response, response)
             try:
-                exec_result = exec_code(client, extract_code(response))
+                exec_result = await asyncio.to_thread(exec_code, client, extract_code(response))
             except Exception as e:
                 exec_result = 'Error occur when running code.'
-            messages.append(exec_result)
+            await asyncio.to_thread(conversation.add_observation, exec_result)
+            # 输出文件已生成的对话提前结束
             if os.path.exists(output_path.replace('/mnt/data', dataset_path)):
                 break
-        conv_result = {
+        return {
             'id': data['id'],
             'instruction_type': data['instruction_type'],
-            'conversation': messages,
+            'conversation': conversation.history,
             'solution': extract_code(response)
         }
-        with open(f'outputs/conv_multi_{opt.setting}_{opt.model}.jsonl', 'a+') as fp:
-            fp.write(json.dumps(conv_result, ensure_ascii=False) + '\n')
+
+    # 每个进行中的对话使用独立的代码执行会话，结果按完成顺序追加，结束后按数据集顺序重写
+    client_pool = ExecClientPool(opt.code_exec_url, opt.conv_id, max(opt.concurrency, 1))
+    asyncio.run(arun_tasks(
+        dataset,
+        solve,
+        lambda conv_result: append_jsonl(conv_path, conv_result),
+        client_pool,
+        concurrency=opt.concurrency,
+        desc=f'multi_{opt.setting}',
+    ))
+    sort_jsonl(conv_path, dataset_order(dataset_ids))
 
 
 def run_solution(opt):
-    client = get_exec_client(opt.code_exec_url, opt.conv_id)
     dataset_path = os.path.abspath(f'../data/{opt.dataset}')
-    with open(f'{dataset_path}/outputs/conv_multi_{opt.setting}_{opt.model}.jsonl', 'r') as fp:
-        conv_records = [json.loads(line) for line in fp.readlines()]
-    for conv in tqdm(conv_records):
-        for idx in range(2, 4):
-            input_file = f"{idx}_{conv['id']}_input.xlsx"
-            output_file = f"{idx}_{conv['id']}_output.xlsx"
-            solution = conv['solution'].replace(f"1_{conv['id']}_input.xlsx", input_file)
-            solution = solution.replace(f"1_{conv['id']}_output.xlsx", output_file)
-            exec_result = exec_code(client, solution)
+    # 每个 (解决方案, 测试用例) 是独立作业，分发到 replay_workers 个隔离会话上并行执行
+    replay_solutions(
+        f'{dataset_path}/outputs/conv_multi_{opt.setting}_{opt.model}.jsonl',
+        f'{dataset_path}/outputs/replay_multi_{opt.setting}_{opt.model}.jsonl',
+        opt.code_exec_url,
+        opt.conv_id,
+        workers=opt.replay_workers,
+        timeout=opt.replay_timeout,
+        resume=opt.resume,
+        backend=opt.replay_backend,
+    )
 
 
 def parse_option():
@@ -146,8 +162,22 @@ def parse_option():
     parser.add_argument('--conv_id', type=str, default="EVAL", help='code execution conversation id')
     parser.add_argument('--max_turn_num', type=int, default=5, help='max turn number of conversation')
     parser.add_argument('--row', type=int, default=5, help='the number of rows provided in the prompt')
+    parser.add_argument('--preview_cache_dir', type=str, default=DEFAULT_PREVIEW_CACHE_DIR, help='directory of the spreadsheet preview cache, empty to disable')
+    parser.add_argument('--preview_full_sheet', action='store_true', help='parse whole sheets so preview column dtypes match earlier versions (slower)')
+    parser.add_argument('--resume', action='store_true', help='skip tasks already recorded in the output files')
+    parser.add_argument('--concurrency', type=int, default=1, help='the number of conversations in flight, each with its own execution session')
+    parser.add_argument('--context_budget', type=int, default=0, help='token budget of the conversation sent to the model, older execution results are compacted beyond it; 0 to disable')
+    parser.add_argument('--tokenizer', type=str, default=None, help='tokenizer name or path used to count tokens, defaults to --model')
+    parser.add_argument('--replay_workers', type=int, default=1, help='the number of solution replay jobs in flight, each with its own execution session')
+    parser.add_argument('--replay_backend', type=str, default='session', choices=REPLAY_BACKENDS, help='run replay jobs in execution sessions or in rlimited one-shot subprocesses')
+    parser.add_argument('--replay_timeout', type=int, default=DEFAULT_REPLAY_TIMEOUT, help='timeout in seconds of one solution replay job')
     
+    add_llm_arguments(parser)
     opt = parser.parse_args()
+    try:
+        validate_replay_backend(opt.replay_backend)
+    except ValueError as e:
+        parser.error(str(e))
 
     return opt
 
@@ -157,4 +187,6 @@ if __name__ == '__main__':
     print(opt)
 
     gen_solution(opt)
+    log_llm_stats()
+    log_output_stats()
     run_solution(opt)
@@ -1,35 +1,23 @@
 import os
 import json
 import argparse
-import pandas as pd
-from tqdm import tqdm
 
-from llm_api import get_llm_response
+from llm_api import get_llm_response, add_llm_arguments, log_llm_stats
 from prompt_format import PROMPT_FORMAT_SINGLE
-from code_exec import get_exec_client, extract_code, exec_code
+from code_exec import extract_code, exec_code
+from execution_result import log_output_stats
+from task_scheduler import ExecClientPool, run_tasks
+from spreadsheet_preview import build_preview, DEFAULT_PREVIEW_CACHE_DIR
+from checkpoint import load_completed_ids, append_jsonl, sort_jsonl, dataset_order
+from replay import replay_solutions, validate_replay_backend, DEFAULT_REPLAY_TIMEOUT, REPLAY_BACKENDS
 
 # Check if local execution mode is enabled
 USE_LOCAL_KERNEL = os.environ.get("USE_LOCAL_KERNEL", "0").lower() == "1"
 
 
 def gen_file_content(input_file):
-    excel_file = pd.ExcelFile(input_file)
-    sheet_names = excel_file.sheet_names
-    excel_data = {}
-
-    for sheet_name in sheet_names:
-        df = excel_file.parse(sheet_name)
-        len = opt.row if df.shape[0] > opt.row else df.shape[0]
-        excel_data[sheet_name] = df.head(len).to_string()
-
-    final_str = ""
-    for sheet_name, sheet_str in excel_data.items():
-        final_str += f"Sheet Name: {sheet_name}\n"
-        final_str += sheet_str + "\n"
-        final_str += "-" * 50 + "\n"
-    
-    return final_str
-    
+    return build_preview(input_file, opt.row, opt.preview_cache_dir, opt.preview_full_sheet)
+
 
 def gen_solution(opt):
     dataset_path = os.path.abspath(f'../data/{opt.dataset}')
@@ -51,10 +39,18 @@ def gen_solution(opt):
         os.makedirs(output_file_path)
         os.chmod(output_file_path, 0o777)
 
-    # create code execution client
-    client = get_exec_client(opt.code_exec_url, opt.conv_id)
+    conv_path = f'outputs/conv_single_{safe_model_name}.jsonl'
+    dataset_ids = [data['id'] for data in dataset]
+    if opt.resume:
+        # 只调度尚未完成的任务；生成失败的记录（conversation 为空）会重新运行
+        completed_ids = load_completed_ids(conv_path, lambda r: r['conversation'] != "")
+        dataset = [data for data in dataset if data['id'] not in completed_ids]
+        print(f"Resuming: {len(completed_ids)} tasks completed, {len(dataset)} remaining")
+
+    # create one code execution client per worker
+    client_pool = ExecClientPool(opt.code_exec_url, opt.conv_id, opt.concurrency)
 
-    for data in tqdm(dataset):
+    def solve(data, client):
         try:
             file_name = f"1_{data['spreadsheet_path'].lstrip('spreadsheet/')}_input.xlsx"
 
@@ -91,6 +87,7 @@ def gen_solution(opt):
                 'conversation': messages,
                 'solution': extract_code(response)
             }
+            return conv_result, None
         except Exception as e:
             print(str(e))
             conv_result = {
@@ -99,29 +96,36 @@ def gen_solution(opt):
                 'conversation': "",
                 'solution': ""
             }
+            return conv_result, data
+
+    def write(result):
+        conv_result, failed_data = result
+        if failed_data is not None:
             with open(f'log/single_{safe_model_name}.jsonl', 'a+') as f:
-                f.write(json.dumps(data, ensure_ascii=False) + '\n')
-        with open(f'outputs/conv_single_{safe_model_name}.jsonl', 'a+') as fp:
-            fp.write(json.dumps(conv_result, ensure_ascii=False) + '\n')
+                f.write(json.dumps(failed_data, ensure_ascii=False) + '\n')
+        append_jsonl(conv_path, conv_result)
+
+    # 每个任务完成后立即追加结果（并发时为完成顺序），进程被结束时只丢失进行中的任务；
+    # 运行结束后按数据集顺序重写，输出文件与串行运行一致
+    run_tasks(dataset, solve, write, client_pool, concurrency=opt.concurrency)
+    sort_jsonl(conv_path, dataset_order(dataset_ids))
 
 
 def run_solution(opt):
-    client = get_exec_client(opt.code_exec_url, opt.conv_id)
     dataset_path = os.path.abspath(f'../data/{opt.dataset}')
     # 将模型名中的 / 替换为 _ 以创建安全的文件路径
     safe_model_name = opt.model.replace('/', '_')
-    with open(f'{dataset_path}/outputs/conv_single_{safe_model_name}.jsonl', 'r') as fp:
-        conv_records = [json.loads(line) for line in fp.readlines()]
-    for conv in tqdm(conv_records):
-        try:
-            for idx in range(2, 4):
-                input_file = f"{idx}_{conv['id']}_input.xlsx"
-                output_file = f"{idx}_{conv['id']}_output.xlsx"
-                solution = conv['solution'].replace(f"1_{conv['id']}_input.xlsx", input_file)
-                solution = solution.replace(f"1_{conv['id']}_output.xlsx", output_file)
-                exec_result = exec_code(client, solution)
-        except Exception as e:
-            print(e)
+    # 每个 (解决方案, 测试用例) 是独立作业，分发到 replay_workers 个隔离会话上并行执行
+    replay_solutions(
+        f'{dataset_path}/outputs/conv_single_{safe_model_name}.jsonl',
+        f'{dataset_path}/outputs/replay_single_{safe_model_name}.jsonl',
+        opt.code_exec_url,
+        opt.conv_id,
+        workers=opt.replay_workers,
+        timeout=opt.replay_timeout,
+        resume=opt.resume,
+        backend=opt.replay_backend,
+    )
 
 
 def parse_option():
@@ -134,7 +138,19 @@ def parse_option():
     parser.add_argument('--code_exec_url', type=str, default="http://localhost:8081/execute", help='code execution docker url')
     parser.add_argument('--conv_id', type=str, default="EVAL", help='code execution conversation id')
     parser.add_argument('--row', type=int, default=5, help='the number of rows provided in the prompt')
+    parser.add_argument('--preview_cache_dir', type=str, default=DEFAULT_PREVIEW_CACHE_DIR, help='directory of the spreadsheet preview cache, empty to disable')
+    parser.add_argument('--preview_full_sheet', action='store_true', help='parse whole sheets so preview column dtypes match earlier versions (slower)')
+    parser.add_argument('--resume', action='store_true', help='skip tasks already recorded in the output files')
+    parser.add_argument('--replay_workers', type=int, default=1, help='the number of solution replay jobs in flight, each with its own execution session')
+    parser.add_argument('--replay_backend', type=str, default='session', choices=REPLAY_BACKENDS, help='run replay jobs in execution sessions or in rlimited one-shot subprocesses')
+    parser.add_argument('--replay_timeout', type=int, default=DEFAULT_REPLAY_TIMEOUT, help='timeout in seconds of one solution replay job')
+    parser.add_argument('--concurrency', type=int, default=1, help='the number of tasks in flight, each with its own execution session')
+    add_llm_arguments(parser)
     opt = parser.parse_args()
+    try:
+        validate_replay_backend(opt.replay_backend)
+    except ValueError as e:
+        parser.error(str(e))
 
     return opt
 
@@ -144,4 +160,6 @@ if __name__ == '__main__':
     print(opt)
 
     gen_solution(opt)
+    log_llm_stats()
+    log_output_stats()
     run_solution(opt)
@@ -1,16 +1,98 @@
 import json
+import time
+import threading
 import requests
 
+from execution_result import ExecutionResult, STATUS_TIMEOUT
+
+_local = threading.local()
+
+
+def get_session():
+    """Per-thread requests.Session, so every request reuses a keep-alive connection."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def endpoint_url(url, endpoint):
+    """Another endpoint of the execution server, e.g. /execute_batch next to an /execute url."""
+    base = url.rstrip("/")
+    if base.endswith("/execute"):
+        base = base[:-len("/execute")]
+    return f"{base}/{endpoint}"
+
+
+def execute_batch(url, jobs, timeout=None):
+    """
+    Run many jobs through the /execute_batch endpoint of the execution server.
+
+    jobs is a list of {"convid", "code"[, "timeout", "reset"]}; jobs of different conversations
+    run concurrently on the server, jobs with reset clear the kernel namespace first.
+    Yields (index, ExecutionResult) in completion order, where index is the position of the
+    job in `jobs`. Raises requests.HTTPError if the server has no batch endpoint.
+    """
+    payload = {"jobs": jobs}
+    if timeout is not None:
+        payload["timeout"] = timeout
+    with get_session().post(endpoint_url(url, "execute_batch"), data=json.dumps(payload), stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                data = json.loads(line)
+                yield data["index"], ExecutionResult.from_dict(data)
+
+
 class ClientJupyterKernel:
+    _warned_no_reset = False
+
     def __init__(self, url, conv_id):
         self.url = url
         self.conv_id = conv_id
         print(f"ClientJupyterKernel initialized with url={url} and conv_id={conv_id}")
 
-    def execute(self, code):
+    def execute(self, code, timeout=None):
+        return self.run(code, timeout=timeout).text
+
+    def run(self, code, timeout=None):
+        """Execute code and return an ExecutionResult built from the structured response fields."""
         payload = {"convid": self.conv_id, "code": code}
-        response = requests.post(self.url, data=json.dumps(payload))
+        if timeout is not None:
+            payload["timeout"] = timeout
+        start = time.monotonic()
+        response = get_session().post(self.url, data=json.dumps(payload))
         response_data = response.json()
         if response_data["new_kernel_created"]:
             print(f"New kernel created for conversation {self.conv_id}")
-        return response_data["result"]
+        if "status" in response_data:
+            return ExecutionResult.from_dict(response_data)
+        return self._from_text(response_data["result"], time.monotonic() - start)
+
+    @staticmethod
+    def _from_text(text, execution_time):
+        """Wrap the plain string returned by servers without structured fields."""
+        if text.startswith("[Execution timed out"):
+            return ExecutionResult(status=STATUS_TIMEOUT, execution_time=execution_time, message=text)
+        result = ExecutionResult(execution_time=execution_time)
+        if text.find("-----") == -1:
+            result.add_stream("stdout", text)
+            return result
+        frames = text.split("\n\n\n\n")
+        ename, _, evalue = frames[-1].partition(":")
+        result.set_error(ename, evalue.strip(), frames)
+        return result
+
+    def reset(self):
+        """
+        Clear the remote kernel namespace while keeping imported modules loaded.
+        The server runs its own reset (JupyterKernel.reset), so the snippet lives in one place
+        per deployable; servers without /reset are left as they are, as before resets existed.
+        """
+        response = get_session().post(endpoint_url(self.url, "reset"), data=json.dumps({"convid": self.conv_id}))
+        if response.status_code == 404:
+            if not ClientJupyterKernel._warned_no_reset:
+                ClientJupyterKernel._warned_no_reset = True
+                print("Execution server has no /reset endpoint, sessions are not reset between tasks")
+            return
+        response.raise_for_status()
@@ -0,0 +1,29 @@
+"""
+内核维护代码片段 - 预热与重置
+Kernel maintenance snippets - warmup and reset
+"""
+
+# 预热代码：提前导入常用的重型库
+WARMUP_CODE = "import pandas as pd\nimport numpy as np\nimport openpyxl"
+
+# 重置代码：清空用户命名空间，关闭遗留的文件句柄与 zip 包（如 openpyxl 只读工作簿），
+# 并执行垃圾回收；已导入的模块仍保留在 sys.modules 中，之后重新导入几乎没有开销。
+# 用于本地内核与 fork 后端；远程执行服务使用 code_exec_docker/jupyter.py 中的 RESET_CODE
+# （ClientJupyterKernel.reset 调用服务端的 /reset），两处修改时需保持一致
+RESET_CODE = """%reset -f
+import gc as _gc, io as _io, os as _os, zipfile as _zipfile
+_gc.collect()
+for _obj in _gc.get_objects():
+    try:
+        if isinstance(_obj, _zipfile.ZipFile):
+            if _obj.fp is not None and isinstance(_obj.filename, str):
+                _obj.close()
+        elif isinstance(_obj, _io.IOBase) and not _obj.closed:
+            if isinstance(getattr(_obj, 'name', None), str) and _os.path.isfile(_obj.name):
+                _obj.close()
+    except Exception:
+        pass
+_obj = None
+_gc.collect()
+del _gc, _io, _os, _zipfile, _obj
+""" + WARMUP_CODE
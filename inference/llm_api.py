@@ -1,11 +1,263 @@
-from typing import List
-from openai import OpenAI
+"""
+LLM 调用模块 - 进程内共享的连接池客户端
+Shared, connection-pooled LLM client (sync and asyncio) for all inference drivers
+"""
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from disk_cache import DiskCache, hash_key
+
+# 默认连接池与超时配置，可通过命令行参数覆盖
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_INFLIGHT = 64
+
+# 响应缓存配置: off 不使用; read 只读命中; readwrite 命中并写回
+CACHE_MODES = ('off', 'read', 'readwrite')
+DEFAULT_CACHE_DIR = 'cache/llm'
+DEFAULT_CACHE_MAX_MB = 1024
+
+# 参与请求与缓存键的采样参数（存在于 opt 且不为 None 时生效）
+SAMPLING_PARAMS = ('temperature', 'top_p', 'max_tokens', 'seed')
+
+
+class LLMClient:
+    """
+    共享的 LLM 客户端
+    同步与异步客户端共用同一套连接池上限、超时和并发上限，每个进程只构建一次
+    """
+
+    def __init__(self, api_key: str, base_url: str, timeout: float = DEFAULT_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_inflight: int = DEFAULT_MAX_INFLIGHT):
+        """
+        参数:
+            api_key: 模型服务的 API key
+            base_url: 模型服务地址
+            timeout: 单次请求超时（秒）
+            max_connections: keep-alive 连接池上限
+            max_inflight: 同时进行的请求数上限
+        """
+        start = time.perf_counter()
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            http_client=httpx.Client(limits=self.limits, timeout=timeout),
+        )
+        self._sync_slots = threading.BoundedSemaphore(max_inflight)
+        # 异步客户端绑定事件循环，首次在某个循环中使用时创建
+        self._async_client = None
+        self._async_slots = None
+        self._async_loop = None
+
+        self._stats_lock = threading.Lock()
+        self.startup_time = time.perf_counter() - start
+        self.num_requests = 0
+        self.request_time = 0.0
+
+    def _async_state(self) -> Tuple[AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+            )
+            self._async_slots = asyncio.Semaphore(self.max_inflight)
+            self._async_loop = loop
+        return self._async_client, self._async_slots
+
+    def _record(self, elapsed: float):
+        with self._stats_lock:
+            self.num_requests += 1
+            self.request_time += elapsed
+
+    def chat(self, messages: List[Dict[str, str]], model: str, **params) -> str:
+        """同步请求，阻塞直到返回"""
+        with self._sync_slots:
+            start = time.perf_counter()
+            chat_completion = self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                **params,
+            )
+            self._record(time.perf_counter() - start)
+        return chat_completion.choices[0].message.content
+
+    async def achat(self, messages: List[Dict[str, str]], model: str, **params) -> str:
+        """异步请求，可在同一事件循环中并发调用"""
+        client, slots = self._async_state()
+        async with slots:
+            start = time.perf_counter()
+            chat_completion = await client.chat.completions.create(
+                messages=messages,
+                model=model,
+                **params,
+            )
+            self._record(time.perf_counter() - start)
+        return chat_completion.choices[0].message.content
+
+    def stats(self) -> Dict[str, float]:
+        """返回客户端构建耗时与请求耗时统计"""
+        with self._stats_lock:
+            mean = self.request_time / self.num_requests if self.num_requests else 0.0
+            return {
+                'startup_time': self.startup_time,
+                'num_requests': self.num_requests,
+                'total_request_time': self.request_time,
+                'mean_request_time': mean,
+            }
+
+
+_clients: Dict[Tuple[str, str], LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(opt) -> LLMClient:
+    """
+    获取进程内共享的 LLM 客户端，按 (api_key, base_url) 缓存
+
+    参数:
+        opt: 命令行参数，需包含 api_key / base_url，
+             可选 llm_timeout / llm_max_connections / llm_max_inflight
+    """
+    key = (opt.api_key, opt.base_url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = LLMClient(
+                opt.api_key,
+                opt.base_url,
+                timeout=getattr(opt, 'llm_timeout', DEFAULT_TIMEOUT),
+                max_connections=getattr(opt, 'llm_max_connections', DEFAULT_MAX_CONNECTIONS),
+                max_inflight=getattr(opt, 'llm_max_inflight', DEFAULT_MAX_INFLIGHT),
+            )
+            logging.info(f"LLM client created for {opt.base_url} "
+                         f"in {_clients[key].startup_time * 1000:.1f} ms")
+        return _clients[key]
+
+
+def to_chat_messages(messages: List[str]) -> List[Dict[str, str]]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": messages[i]} for i in range(len(messages))]
+
+
+def sampling_params(opt) -> Dict[str, object]:
+    return {k: getattr(opt, k) for k in SAMPLING_PARAMS if getattr(opt, k, None) is not None}
+
+
+class ResponseCache:
+    """
+    LLM 响应缓存
+    键为 (model, base_url, 完整消息列表, 采样参数) 的哈希
+    """
+
+    def __init__(self, mode: str, cache_dir: str, max_mb: float):
+        self.mode = mode
+        self.store = DiskCache(cache_dir, max_bytes=int(max_mb * 1024 * 1024) if max_mb else None)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(opt, messages: List[Dict[str, str]], params: Dict[str, object]) -> str:
+        return hash_key({
+            'model': opt.model,
+            'base_url': opt.base_url,
+            'messages': messages,
+            'params': params,
+        })
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.store.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['response']
+
+    def put(self, key: str, response: str):
+        if self.mode == 'readwrite':
+            self.store.put(key, {'response': response})
+
+
+_caches: Dict[Tuple[str, str], ResponseCache] = {}
+
+
+def get_response_cache(opt) -> Optional[ResponseCache]:
+    """按命令行参数获取响应缓存，--cache off 时返回 None"""
+    mode = getattr(opt, 'cache', 'off')
+    if mode == 'off':
+        return None
+    cache_dir = getattr(opt, 'cache_dir', DEFAULT_CACHE_DIR)
+    with _clients_lock:
+        if (mode, cache_dir) not in _caches:
+            _caches[(mode, cache_dir)] = ResponseCache(
+                mode, cache_dir, getattr(opt, 'cache_max_mb', DEFAULT_CACHE_MAX_MB)
+            )
+        return _caches[(mode, cache_dir)]
+
 
 def get_llm_response(messages: List[str], opt):
-    client = OpenAI(api_key=opt.api_key, base_url=opt.base_url)
-    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": messages[i]} for i in range(len(messages))]
-    chat_completion = client.chat.completions.create(
-        messages=messages,
-        model=opt.model,
-    )
-    return chat_completion.choices[0].message.content
+    chat_messages = to_chat_messages(messages)
+    params = sampling_params(opt)
+    cache = get_response_cache(opt)
+    if cache is not None:
+        key = cache.key(opt, chat_messages, params)
+        response = cache.get(key)
+        if response is not None:
+            return response
+    response = get_llm_client(opt).chat(chat_messages, opt.model, **params)
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+async def aget_llm_response(messages: List[str], opt):
+    chat_messages = to_chat_messages(messages)
+    params = sampling_params(opt)
+    cache = get_response_cache(opt)
+    if cache is not None:
+        key = cache.key(opt, chat_messages, params)
+        response = cache.get(key)
+        if response is not None:
+            return response
+    response = await get_llm_client(opt).achat(chat_messages, opt.model, **params)
+    if cache is not None:
+        cache.put(key, response)
+    return response
+
+
+def log_llm_stats():
+    """打印所有共享客户端的耗时统计"""
+    for (_, base_url), client in _clients.items():
+        stats = client.stats()
+        print(f"LLM client {base_url}: startup {stats['startup_time'] * 1000:.1f} ms, "
+              f"{stats['num_requests']} requests, "
+              f"mean {stats['mean_request_time']:.3f} s/request")
+    for (mode, cache_dir), cache in _caches.items():
+        print(f"LLM response cache {cache_dir} ({mode}): {cache.hits} hits, {cache.misses} misses")
+
+
+def add_llm_arguments(parser):
+    """向命令行解析器添加 LLM 客户端相关参数"""
+    parser.add_argument('--llm_timeout', type=float, default=DEFAULT_TIMEOUT, help='per-request timeout of model calls in seconds')
+    parser.add_argument('--llm_max_connections', type=int, default=DEFAULT_MAX_CONNECTIONS, help='size of the keep-alive connection pool to the model server')
+    parser.add_argument('--llm_max_inflight', type=int, default=DEFAULT_MAX_INFLIGHT, help='max number of concurrent model requests')
+    parser.add_argument('--cache', type=str, default='off', choices=CACHE_MODES, help='on-disk model response cache mode')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='directory of the model response cache')
+    parser.add_argument('--cache_max_mb', type=float, default=DEFAULT_CACHE_MAX_MB, help='size limit of the model response cache in MB, LRU evicted')
+    return parser
@@ -5,11 +5,14 @@
 Local Jupyter Kernel Client - Execute code directly without Docker
 Uses jupyter_client to communicate with local Jupyter kernels
 """
+import os
 import json
+import time
 import logging
 import queue
 import atexit
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, List
 
 try:
     import jupyter_client
@@ -18,8 +21,25 @@ except ImportError:
     JUPYTER_CLIENT_AVAILABLE = False
     logging.warning("jupyter_client not installed. Local kernel execution will not be available.")
 
+from kernel_snippets import WARMUP_CODE, RESET_CODE
+from execution_result import ExecutionResult
+
 logging.basicConfig(level=logging.INFO)
 
+# 内核池配置（环境变量）
+# LOCAL_KERNEL_POOL_MIN: 保持预热的空闲内核数
+# LOCAL_KERNEL_POOL_MAX: 内核总数上限（空闲 + 使用中 + 启动中）
+# LOCAL_KERNEL_POOL_IDLE_TIMEOUT: 超出 MIN 的空闲内核在闲置多少秒后被回收
+POOL_MIN_SIZE = int(os.environ.get("LOCAL_KERNEL_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.environ.get("LOCAL_KERNEL_POOL_MAX", "64"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("LOCAL_KERNEL_POOL_IDLE_TIMEOUT", "300"))
+
+# 执行配置（环境变量）
+# LOCAL_KERNEL_MAX_OUTPUT_CHARS: 单次执行收集的输出字符数上限，0 表示不限制
+MAX_OUTPUT_CHARS = int(os.environ.get("LOCAL_KERNEL_MAX_OUTPUT_CHARS", "1000000"))
+# 超时后等待中断生效的时间（秒），超过则重启内核
+INTERRUPT_GRACE = 5
+
 
 class LocalJupyterKernel:
     """
@@ -27,13 +47,15 @@ class LocalJupyterKernel:
     直接与本地 Jupyter 内核通信，无需 Docker 或 HTTP API
     """
 
-    def __init__(self, conv_id: str, kernel_name: str = "python3"):
+    def __init__(self, conv_id: str, kernel_name: str = "python3",
+                 max_output_chars: int = MAX_OUTPUT_CHARS):
         """
         初始化本地 Jupyter 内核
 
         参数:
             conv_id: 会话ID，用于标识不同的执行会话
             kernel_name: 内核名称，默认为 python3
+            max_output_chars: 单次执行收集的输出字符数上限，0 表示不限制
         """
         if not JUPYTER_CLIENT_AVAILABLE:
             raise ImportError(
@@ -43,6 +65,7 @@ class LocalJupyterKernel:
 
         self.conv_id = conv_id
         self.kernel_name = kernel_name
+        self.max_output_chars = max_output_chars
         self.km = None  # KernelManager: 内核管理器
         self.kc = None  # KernelClient: 内核客户端
         self._initialized = False
@@ -66,24 +89,53 @@ class LocalJupyterKernel:
 
         参数:
             code: 要执行的 Python 代码
-            timeout: 执行超时时间（秒）
+            timeout: 整个执行过程的超时时间（秒），而不是单条消息的等待时间
 
         返回:
             执行结果字符串
         """
+        return self.run(code, timeout=timeout).text
+
+    def run(self, code: str, timeout: int = 60) -> ExecutionResult:
+        """
+        在内核中执行代码并返回结构化结果
+
+        参数:
+            code: 要执行的 Python 代码
+            timeout: 整个执行过程的超时时间（秒），而不是单条消息的等待时间
+
+        返回:
+            ExecutionResult
+        """
         if not self.kc:
             self._start_kernel()
 
+        start = time.monotonic()
         # 发送执行请求
         msg_id = self.kc.execute(code)
 
-        outputs = []
+        result = ExecutionResult()
+        output_size = 0
+        truncated = False
         execution_done = False
+        deadline = start + timeout
+
+        def budget(text):
+            # 超出输出上限后丢弃后续输出，但继续读取消息直到执行结束
+            nonlocal output_size, truncated
+            if self.max_output_chars and output_size + len(text) > self.max_output_chars:
+                text = text[:max(self.max_output_chars - output_size, 0)]
+                truncated = True
+            output_size += len(text)
+            return text
 
         while not execution_done:
+            remaining = deadline - time.monotonic()
             try:
+                if remaining <= 0:
+                    raise queue.Empty
                 # 从 iopub 通道获取消息
-                msg = self.kc.get_iopub_msg(timeout=timeout)
+                msg = self.kc.get_iopub_msg(timeout=remaining)
                 msg_type = msg['msg_type']
                 content = msg['content']
 
@@ -92,23 +144,25 @@ class LocalJupyterKernel:
                     continue
 
                 if msg_type == 'error':
-                    # 收集错误回溯信息
-                    traceback = '\n\n\n\n'.join(content.get('traceback', []))
-                    outputs.append(self._strip_ansi(traceback))
+                    # 收集错误回溯信息（不受输出上限影响，保证错误信息完整）
+                    result.set_error(
+                        content.get('ename', ''),
+                        content.get('evalue', ''),
+                        [self._strip_ansi(frame) for frame in content.get('traceback', [])],
+                    )
                     execution_done = True
 
                 elif msg_type == 'stream':
                     # 标准输出/错误流
-                    outputs.append(content.get('text', ''))
+                    result.add_stream(content.get('name', 'stdout'), budget(content.get('text', '')))
 
                 elif msg_type in ['execute_result', 'display_data']:
                     # 执行结果或显示数据
-                    data = content.get('data', {})
-                    if 'text/plain' in data:
-                        outputs.append(data['text/plain'])
-                    if 'image/png' in data:
-                        # 将图片转为 Markdown 格式
-                        outputs.append(f"![image](data:image/png;base64,{data['image/png']})")
+                    data = {}
+                    for mime in ('text/plain', 'image/png'):
+                        if mime in content.get('data', {}):
+                            data[mime] = budget(content['data'][mime])
+                    result.add_data(msg_type, data)
 
                 elif msg_type == 'status':
                     # 内核状态变为空闲表示执行完成
@@ -116,14 +170,53 @@ class LocalJupyterKernel:
                         execution_done = True
 
             except queue.Empty:
-                return f"[Execution timed out ({timeout} seconds).]"
+                # 超时：中断内核，避免失控的代码继续占用 CPU 并阻塞后续执行
+                self._interrupt(msg_id)
+                return ExecutionResult.timeout(timeout, time.monotonic() - start)
             except Exception as e:
-                return f"[Execution error: {str(e)}]"
+                return ExecutionResult.failed(str(e), time.monotonic() - start)
 
-        if not outputs:
-            return "[Code executed successfully with no output]"
+        if truncated:
+            result.message = f"\n[Output truncated: exceeded {self.max_output_chars} characters]"
+        result.execution_time = time.monotonic() - start
+        return result
+
+    def _interrupt(self, msg_id: str):
+        """
+        中断正在执行的代码：等待内核回到空闲状态，
+        若在宽限时间内未能中断，则重启内核
+        """
+        try:
+            self.km.interrupt_kernel()
+            deadline = time.monotonic() + INTERRUPT_GRACE
+            while time.monotonic() < deadline:
+                msg = self.kc.get_iopub_msg(timeout=max(deadline - time.monotonic(), 0.01))
+                if (msg['parent_header'].get('msg_id') == msg_id
+                        and msg['msg_type'] == 'status'
+                        and msg['content'].get('execution_state') == 'idle'):
+                    logging.info(f"Kernel interrupted for conversation {self.conv_id}")
+                    return
+        except queue.Empty:
+            pass
+        except Exception as e:
+            logging.warning(f"Failed to interrupt kernel for conversation {self.conv_id}: {e}")
+
+        logging.warning(f"Interrupt did not stop execution, restarting kernel for conversation {self.conv_id}")
+        self.km.restart_kernel(now=True)
+        self.kc.wait_for_ready(timeout=60)
+        self.warmup()
 
-        return ''.join(outputs)
+    def warmup(self):
+        """预先导入 pandas / numpy / openpyxl，之后的会话无需再付导入开销"""
+        self.execute(WARMUP_CODE)
+
+    def reset(self):
+        """
+        轻量重置：清空用户命名空间、关闭遗留文件句柄并执行 gc，
+        保留已导入的重型库，比重启内核快得多
+        """
+        if self.kc:
+            self.execute(RESET_CODE)
 
     def _strip_ansi(self, text: str) -> str:
         """移除文本中的 ANSI 转义序列（终端颜色代码等）"""
@@ -160,33 +253,195 @@ class LocalKernelClient:
         self._new_kernel = True
         print(f"LocalKernelClient initialized with conv_id={conv_id}")
 
-    def execute(self, code: str) -> str:
+    def execute(self, code: str, timeout: int = 60) -> str:
         """
         执行代码并返回结果
 
         参数:
             code: 要执行的代码
+            timeout: 执行超时时间（秒）
 
         返回:
             执行结果
         """
+        return self.run(code, timeout=timeout).text
+
+    def run(self, code: str, timeout: int = 60) -> ExecutionResult:
+        """
+        执行代码并返回结构化结果
+
+        参数:
+            code: 要执行的代码
+            timeout: 执行超时时间（秒）
+        """
         if self.kernel is None:
-            # 延迟创建内核，首次执行时才启动
-            self.kernel = LocalJupyterKernel(self.conv_id)
+            # 首次执行时从内核池借出一个已预热的内核
+            self.kernel = LocalKernelManager.checkout_kernel(self.conv_id)
             self._new_kernel = True
         else:
             self._new_kernel = False
 
-        result = self.kernel.execute(code)
-        return result
+        return self.kernel.run(code, timeout=timeout)
+
+    def reset(self):
+        """重置内核状态，供下一个任务使用"""
+        if self.kernel:
+            self.kernel.reset()
 
     def shutdown(self):
-        """关闭内核"""
+        """归还内核，由内核池在后台销毁并补充新内核"""
         if self.kernel:
-            self.kernel.shutdown()
+            LocalKernelManager.release_kernel(self.kernel)
             self.kernel = None
 
 
+class KernelPool:
+    """
+    预热内核池
+    后台线程保持至少 min_size 个已启动并导入常用库的空闲内核，
+    会话借出时无需等待内核启动；归还的内核在后台销毁并补充新内核
+    """
+
+    def __init__(self, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, kernel_name: str = "python3"):
+        """
+        参数:
+            min_size: 保持预热的空闲内核数
+            max_size: 内核总数上限
+            idle_timeout: 超出 min_size 的空闲内核的回收时间（秒）
+            kernel_name: 内核名称
+        """
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.kernel_name = kernel_name
+        self._idle: List[LocalJupyterKernel] = []
+        self._idle_since: Dict[int, float] = {}
+        self._busy = 0
+        self._starting = 0       # 后台启动中的内核（启动后进入空闲列表）
+        self._sync_starting = 0  # checkout 同步启动中的内核（已计入 _busy）
+        self._waiting = 0        # 等待空闲内核的 checkout 调用数
+        self._retry_at = 0.0     # 后台启动失败后，下次重试的时间
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._maintain, daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def _total(self) -> int:
+        return len(self._idle) + self._busy + self._starting
+
+    def _new_kernel(self, conv_id: str) -> LocalJupyterKernel:
+        kernel = LocalJupyterKernel(conv_id, self.kernel_name)
+        kernel.warmup()
+        return kernel
+
+    def _discard(self, kernel: LocalJupyterKernel):
+        threading.Thread(target=kernel.shutdown, daemon=True).start()
+
+    def _start_pooled(self):
+        """后台启动一个内核放入空闲列表（调用前已计入 _starting）"""
+        kernel = None
+        try:
+            kernel = self._new_kernel("pool")
+        except Exception as e:
+            logging.warning(f"Failed to start pooled kernel: {e}")
+        with self._cond:
+            self._starting -= 1
+            if kernel is None:
+                self._retry_at = time.time() + 1.0
+            elif not self._stopped:
+                self._idle.append(kernel)
+                self._idle_since[id(kernel)] = time.time()
+            else:
+                self._discard(kernel)
+            self._cond.notify_all()
+
+    def _maintain(self):
+        """后台维护：并行补足空闲内核，回收闲置过久的内核"""
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                # 同步启动中的内核也计入，避免与 checkout 同时为同一缺口启动内核
+                to_start = 0
+                while (len(self._idle) + self._starting + self._sync_starting < self.min_size
+                       and self._total() < self.max_size and time.time() >= self._retry_at):
+                    self._starting += 1
+                    to_start += 1
+                to_reap = []
+                now = time.time()
+                while len(self._idle) > self.min_size:
+                    oldest = self._idle[0]
+                    if now - self._idle_since[id(oldest)] < self.idle_timeout:
+                        break
+                    self._idle.pop(0)
+                    self._idle_since.pop(id(oldest), None)
+                    to_reap.append(oldest)
+            for kernel in to_reap:
+                self._discard(kernel)
+            for _ in range(to_start):
+                threading.Thread(target=self._start_pooled, daemon=True).start()
+            with self._cond:
+                self._cond.wait(timeout=1.0)
+
+    def grow(self, min_size: int):
+        """提高保持预热的空闲内核数（不超过 max_size），后台立即开始补足"""
+        with self._cond:
+            self.min_size = max(self.min_size, min(min_size, self.max_size))
+            self._cond.notify_all()
+
+    def checkout(self, conv_id: str) -> LocalJupyterKernel:
+        """
+        借出一个内核，有空闲内核时立即返回；后台正在启动的内核足够分给所有等待者时等待它们，
+        否则同步启动一个新内核
+
+        参数:
+            conv_id: 借用内核的会话ID
+        """
+        with self._cond:
+            self._waiting += 1
+            while not self._idle and (self._waiting <= self._starting or self._total() >= self.max_size):
+                self._cond.wait()
+            self._waiting -= 1
+            if self._idle:
+                kernel = self._idle.pop()
+                self._idle_since.pop(id(kernel), None)
+                self._busy += 1
+                self._cond.notify_all()
+                kernel.conv_id = conv_id
+                return kernel
+            self._busy += 1
+            self._sync_starting += 1
+        try:
+            return self._new_kernel(conv_id)
+        except Exception:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify_all()
+            raise
+        finally:
+            with self._cond:
+                self._sync_starting -= 1
+
+    def release(self, kernel: LocalJupyterKernel):
+        """归还内核：在后台销毁，并唤醒维护线程补充新内核"""
+        self._discard(kernel)
+        with self._cond:
+            self._busy -= 1
+            self._cond.notify_all()
+
+    def shutdown(self):
+        """关闭内核池及其中所有空闲内核"""
+        with self._cond:
+            self._stopped = True
+            idle, self._idle = self._idle, []
+            self._idle_since.clear()
+            self._cond.notify_all()
+        for kernel in idle:
+            kernel.shutdown()
+
+
 class LocalKernelManager:
     """
     本地内核管理器（单例模式）
@@ -195,6 +450,8 @@ class LocalKernelManager:
 
     _instance = None
     _kernels: Dict[str, LocalKernelClient] = {}
+    _pool: Optional[KernelPool] = None
+    _pool_lock = threading.Lock()
 
     def __new__(cls):
         """单例模式实现"""
@@ -218,12 +475,61 @@ class LocalKernelManager:
             cls._kernels[conv_id] = LocalKernelClient(conv_id)
         return cls._kernels[conv_id]
 
+    @classmethod
+    def configure_pool(cls, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                       idle_timeout: float = POOL_IDLE_TIMEOUT):
+        """
+        配置内核池，需在首次借出内核之前调用
+
+        参数:
+            min_size: 保持预热的空闲内核数
+            max_size: 内核总数上限
+            idle_timeout: 超出 min_size 的空闲内核的回收时间（秒）
+        """
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.shutdown()
+            cls._pool = KernelPool(min_size, max_size, idle_timeout)
+
+    @classmethod
+    def get_pool(cls) -> KernelPool:
+        """获取内核池，首次调用时按环境变量配置创建"""
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = KernelPool()
+            return cls._pool
+
+    @classmethod
+    def prewarm(cls, min_size: int):
+        """
+        在提交任务之前预热内核池，保持至少 min_size 个空闲内核（通常为并发度），
+        使第一批任务借出内核时无需各自同步启动
+
+        参数:
+            min_size: 保持预热的空闲内核数
+        """
+        cls.get_pool().grow(min_size)
+
+    @classmethod
+    def checkout_kernel(cls, conv_id: str) -> LocalJupyterKernel:
+        """从内核池借出一个已预热的内核"""
+        return cls.get_pool().checkout(conv_id)
+
+    @classmethod
+    def release_kernel(cls, kernel: LocalJupyterKernel):
+        """将内核归还给内核池"""
+        cls.get_pool().release(kernel)
+
     @classmethod
     def shutdown_all(cls):
         """关闭所有内核"""
         for conv_id, client in cls._kernels.items():
             client.shutdown()
         cls._kernels.clear()
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.shutdown()
+                cls._pool = None
         logging.info("All local kernels shutdown")
 
 
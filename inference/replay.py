@@ -0,0 +1,192 @@
+"""
+解决方案回放 - 在测试用例 2、3 上并行重放已生成的解决方案
+回放不需要调用大模型，只受代码执行速度限制；每个 (解决方案, 测试用例) 组合是一个独立作业，
+分发到一组相互隔离的执行会话上，每个作业有独立的超时，并把状态、耗时和错误输出写入结果文件；
+远程模式下所有作业通过一次 /execute_batch 请求提交，结果按完成顺序流式返回
+
+Solution replay - re-runs generated solutions on test cases 2 and 3 in parallel
+Replay needs no LLM and is purely execution-bound; every (solution, test case) pair is an
+independent job spread across isolated execution sessions, each with its own timeout.
+Status, wall time and stderr of every job are recorded in the results file. In remote mode
+all jobs are submitted in one /execute_batch request and results stream back as they finish
+"""
+import time
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from batch_executor import SubprocessExecutor
+from checkpoint import append_jsonl, load_records, sort_jsonl, dataset_order
+from code_exec import USE_LOCAL_KERNEL
+from execution_result import STATUS_OK, ExecutionResult
+from task_scheduler import ExecClientPool, run_tasks, worker_conv_id
+
+if not USE_LOCAL_KERNEL:
+    import requests
+    from jupyter_kernel_cli import execute_batch
+
+# 默认的单个作业超时（秒）
+DEFAULT_REPLAY_TIMEOUT = 60
+
+# 回放后端: session 使用代码执行会话（与推理相同的执行环境），
+# subprocess 使用带资源限制的一次性子进程，不经过 Jupyter
+REPLAY_BACKENDS = ('session', 'subprocess')
+
+
+def validate_replay_backend(backend: str):
+    """
+    subprocess 后端在本机运行脚本，只能用于本地模式：远程模式下解决方案使用 Docker 提示词中的
+    /mnt/data 路径，本机子进程无法打开这些文件
+    """
+    if backend == 'subprocess' and not USE_LOCAL_KERNEL:
+        raise ValueError("--replay_backend subprocess requires USE_LOCAL_KERNEL=1: remote-mode solutions "
+                         "read /mnt/data paths that only exist inside the execution sandbox")
+
+
+def rewrite_solution(solution: str, task_id: str, test_case: int) -> str:
+    """把解决方案中测试用例 1 的输入/输出文件名替换为指定测试用例的文件名"""
+    solution = solution.replace(f"1_{task_id}_input.xlsx", f"{test_case}_{task_id}_input.xlsx")
+    return solution.replace(f"1_{task_id}_output.xlsx", f"{test_case}_{task_id}_output.xlsx")
+
+
+def build_replay_jobs(conv_records: Iterable[Dict[str, Any]],
+                      replayed: Set[Tuple[Any, int]] = frozenset()) -> List[Dict[str, Any]]:
+    """
+    展开所有 (解决方案, 测试用例) 作业
+
+    参数:
+        conv_records: 推理结果记录，同一任务有多条时以最后一条为准
+        replayed: 已回放过的 (id, test_case)，续跑时跳过
+    """
+    conv_records = {conv['id']: conv for conv in conv_records}.values()
+    jobs = []
+    for conv in conv_records:
+        for idx in range(2, 4):
+            if (conv['id'], idx) in replayed:
+                continue
+            jobs.append({
+                'id': conv['id'],
+                'test_case': idx,
+                'code': rewrite_solution(conv['solution'], conv['id'], idx),
+            })
+    return jobs
+
+
+def run_replay_job(job: Dict[str, Any], client, timeout: int = DEFAULT_REPLAY_TIMEOUT) -> Dict[str, Any]:
+    """
+    在给定的执行会话或子进程执行器上运行一个回放作业
+
+    返回:
+        结果记录 {'id', 'test_case', 'status', 'wall_time', 'stdout', 'stderr'}，
+        status 为 ok / error / timeout / failed（执行环境出错）/ exception（客户端抛出异常）
+    """
+    start = time.monotonic()
+    try:
+        return replay_record(job, client.run(job['code'], timeout=timeout), time.monotonic() - start)
+    except Exception as e:
+        return {
+            'id': job['id'],
+            'test_case': job['test_case'],
+            'status': 'exception',
+            'wall_time': round(time.monotonic() - start, 4),
+            'stdout': '',
+            'stderr': f"{type(e).__name__}: {e}",
+        }
+
+
+def replay_record(job: Dict[str, Any], result: ExecutionResult, wall_time: float) -> Dict[str, Any]:
+    """由执行结果生成回放结果记录，失败时 stderr 末尾附加精简的错误信息"""
+    stderr = result.stderr
+    if result.status != STATUS_OK:
+        stderr += result.error_summary()
+    return {
+        'id': job['id'],
+        'test_case': job['test_case'],
+        'status': result.status,
+        'wall_time': round(wall_time, 4),
+        'stdout': result.stdout,
+        'stderr': stderr,
+    }
+
+
+def replay_batch(jobs: List[Dict[str, Any]], url: str, conv_id: str, workers: int, timeout: int,
+                 write_fn: Callable[[Dict[str, Any]], None]) -> bool:
+    """
+    远程模式下通过 /execute_batch 一次提交所有作业，结果按完成顺序写入
+
+    作业轮流分配到 workers 个会话上，服务端同一会话的作业依次执行，不同会话并行执行，
+    并发度与逐个请求时相同；每个作业执行前重置会话，与逐个请求时作业之间的重置一致；
+    wall_time 为服务端的执行耗时
+
+    返回:
+        False 表示服务端不支持批量接口，需要改为逐个请求
+    """
+    batch = [
+        {'convid': worker_conv_id(conv_id, i % workers, workers), 'code': job['code'],
+         'timeout': timeout, 'reset': True}
+        for i, job in enumerate(jobs)
+    ]
+    try:
+        for index, result in execute_batch(url, batch):
+            write_fn(replay_record(jobs[index], result, result.execution_time))
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            print("Execution server has no /execute_batch endpoint, replaying job by job")
+            return False
+        raise
+    return True
+
+
+def replay_solutions(conv_path: str, replay_path: str, url: str, conv_id: str,
+                     workers: int = 1, timeout: int = DEFAULT_REPLAY_TIMEOUT, resume: bool = False,
+                     backend: str = 'session'):
+    """
+    并行回放解决方案
+
+    参数:
+        conv_path: 推理结果文件（JSONL）
+        replay_path: 回放结果文件（JSONL），每个作业一条记录
+        url: 远程执行服务的 URL（本地模式下忽略）
+        conv_id: 基础会话ID，每个 worker 使用独立会话
+        workers: 同时运行的作业数
+        timeout: 单个作业的超时时间（秒）
+        resume: 跳过回放结果文件中已有的作业
+        backend: 回放后端，session 或 subprocess（见 REPLAY_BACKENDS）
+    """
+    validate_replay_backend(backend)
+    replayed = set()
+    if resume:
+        replayed = {(r['id'], r['test_case']) for r in load_records(replay_path)}
+    conv_records = load_records(conv_path)
+    jobs = build_replay_jobs(conv_records, replayed)
+    if not jobs:
+        return
+
+    statuses = {}
+
+    def write(record):
+        append_jsonl(replay_path, record)
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+
+    # 远程会话后端：一次批量请求代替每个作业一次 HTTP 往返
+    batched = (backend == 'session' and not USE_LOCAL_KERNEL
+               and replay_batch(jobs, url, conv_id, max(workers, 1), timeout, write))
+
+    if not batched:
+        if backend == 'subprocess':
+            client_pool = ExecClientPool(url, conv_id, max(workers, 1),
+                                         factory=lambda url, conv_id: SubprocessExecutor())
+        else:
+            client_pool = ExecClientPool(url, conv_id, max(workers, 1))
+
+        run_tasks(
+            jobs,
+            lambda job, client: run_replay_job(job, client, timeout),
+            write,
+            client_pool,
+            concurrency=workers,
+            desc='replay',
+        )
+
+    # 记录按完成顺序追加，结束后按 (解决方案顺序, 测试用例) 重写
+    order = dataset_order([conv['id'] for conv in conv_records])
+    sort_jsonl(replay_path, lambda record: (order(record), record['test_case']))
+    print(f"Replayed {len(jobs)} jobs: {statuses}")
@@ -0,0 +1,142 @@
+"""
+表格预览生成 - 为提示词构建每个工作表前 N 行的文本
+只以只读流式方式读取前 N 行，并按 (文件路径, mtime, 行数) 持久化缓存；
+列类型只由前 N 行推断，与解析整张表后取前 N 行的旧输出可能不同
+（如整数列在后面的行有空单元格时，旧输出显示 0.0，这里显示 0），需要与旧结果对比时使用 full_sheet
+
+Spreadsheet preview builder - renders the first N rows of every sheet for prompts
+Reads only the first N rows in read-only streaming mode, memoized on disk by (path, mtime, rows).
+Column dtypes are inferred from those N rows only, so the text can differ from the earlier
+parse-whole-sheet-then-head output (an int column with a blank cell further down used to show
+0.0 and now shows 0); full_sheet reproduces the earlier output for comparable runs
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import pandas as pd
+from tqdm import tqdm
+
+from disk_cache import DiskCache, hash_key
+
+DEFAULT_PREVIEW_CACHE_DIR = 'cache/previews'
+DEFAULT_PREVIEW_CACHE_MAX_MB = 256
+
+_caches = {}
+
+
+def _get_cache(cache_dir: Optional[str]) -> Optional[DiskCache]:
+    if not cache_dir:
+        return None
+    if cache_dir not in _caches:
+        _caches[cache_dir] = DiskCache(cache_dir, max_bytes=DEFAULT_PREVIEW_CACHE_MAX_MB * 1024 * 1024)
+    return _caches[cache_dir]
+
+
+def render_preview(input_file: str, rows: int, full_sheet: bool = False) -> str:
+    """
+    读取每个工作表的前 rows 行并渲染为文本
+
+    pandas 的 openpyxl 引擎以 read_only 模式打开工作簿，
+    指定 nrows 后读到所需行数即停止，不再解析整张表；
+    full_sheet 为 True 时解析整张表再取前 rows 行，列类型与旧实现一致
+    """
+    excel_data = {}
+    with pd.ExcelFile(input_file) as excel_file:
+        for sheet_name in excel_file.sheet_names:
+            if full_sheet:
+                df = excel_file.parse(sheet_name).head(rows)
+            else:
+                df = excel_file.parse(sheet_name, nrows=rows)
+            excel_data[sheet_name] = df.to_string()
+
+    final_str = ""
+    for sheet_name, sheet_str in excel_data.items():
+        final_str += f"Sheet Name: {sheet_name}\n"
+        final_str += sheet_str + "\n"
+        final_str += "-" * 50 + "\n"
+
+    return final_str
+
+
+def build_preview(input_file: str, rows: int, cache_dir: Optional[str] = DEFAULT_PREVIEW_CACHE_DIR,
+                  full_sheet: bool = False) -> str:
+    """
+    获取表格预览，优先使用缓存
+
+    参数:
+        input_file: 表格文件路径
+        rows: 每个工作表保留的行数
+        cache_dir: 缓存目录，为空时不使用缓存
+        full_sheet: 解析整张表以得到与旧实现一致的列类型（较慢）
+
+    返回:
+        预览文本
+    """
+    cache = _get_cache(cache_dir)
+    if cache is None:
+        return render_preview(input_file, rows, full_sheet)
+
+    input_file = os.path.abspath(input_file)
+    key = hash_key({
+        'path': input_file,
+        'mtime': os.stat(input_file).st_mtime_ns,
+        'rows': rows,
+        'full_sheet': full_sheet,
+    })
+    preview = cache.get(key)
+    if preview is None:
+        preview = render_preview(input_file, rows, full_sheet)
+        cache.put(key, preview)
+    return preview
+
+
+def _precompute_one(args):
+    input_file, rows, cache_dir, full_sheet = args
+    try:
+        build_preview(input_file, rows, cache_dir, full_sheet)
+        return None
+    except Exception as e:
+        return f"{input_file}: {e}"
+
+
+def precompute_previews(dataset_path: str, rows: int, cache_dir: str = DEFAULT_PREVIEW_CACHE_DIR,
+                        workers: int = None, full_sheet: bool = False):
+    """
+    并行预计算整个数据集提示词所用的表格预览
+
+    参数:
+        dataset_path: 数据集目录（包含 dataset.json）
+        rows: 每个工作表保留的行数
+        cache_dir: 缓存目录
+        workers: 进程数，默认为 CPU 核数
+        full_sheet: 解析整张表以得到与旧实现一致的列类型
+    """
+    with open(f'{dataset_path}/dataset.json', 'r') as fp:
+        dataset = json.load(fp)
+
+    jobs = []
+    for data in dataset:
+        # 与推理脚本中构造提示词时使用的路径保持一致，以便命中缓存
+        file_name = f"1_{data['spreadsheet_path'].lstrip('spreadsheet/')}_input.xlsx"
+        jobs.append((f"{dataset_path}/{data['spreadsheet_path']}/{file_name}", rows, cache_dir, full_sheet))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for error in tqdm(executor.map(_precompute_one, jobs, chunksize=4), total=len(jobs)):
+            if error:
+                print(error)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("command line arguments for preview precomputation.")
+    parser.add_argument('--dataset', type=str, default="sample_data_200", help='dataset name')
+    parser.add_argument('--row', type=int, default=5, help='the number of rows provided in the prompt')
+    parser.add_argument('--preview_cache_dir', type=str, default=DEFAULT_PREVIEW_CACHE_DIR, help='directory of the spreadsheet preview cache')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--preview_full_sheet', action='store_true', help='parse whole sheets so column dtypes match previews of earlier versions')
+    opt = parser.parse_args()
+
+    precompute_previews(os.path.abspath(f'../data/{opt.dataset}'), opt.row, opt.preview_cache_dir, opt.workers,
+                        opt.preview_full_sheet)
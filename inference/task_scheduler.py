@@ -0,0 +1,165 @@
+"""
+并发任务调度器 - 让多个推理任务同时进行
+每个 worker 拥有独立的代码执行会话，结果按完成顺序立即写出，进程被结束时只丢失进行中的任务；
+调用方在运行结束后用 checkpoint.sort_jsonl 把结果文件恢复为数据集顺序
+
+Concurrent task scheduler - keeps several inference tasks in flight
+Each worker owns its own execution session; results are written as soon as they finish,
+so killing the process only loses the tasks in flight; callers restore dataset order with
+checkpoint.sort_jsonl once the run finishes
+"""
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Awaitable, Callable, Iterable, List
+
+from tqdm import tqdm
+
+from code_exec import get_exec_client, prewarm_exec_clients, reset_exec_client
+
+
+def worker_conv_id(conv_id: str, worker_idx: int, concurrency: int) -> str:
+    """
+    生成 worker 的会话ID
+
+    并发度为 1 时保持原有会话ID不变，否则追加 worker 序号
+    """
+    if concurrency <= 1:
+        return conv_id
+    return f"{conv_id}-{worker_idx}"
+
+
+class ExecClientPool:
+    """
+    代码执行客户端池
+    每个客户端对应一个独立会话（conv_id），同一时刻只借给一个任务
+    """
+
+    def __init__(self, url: str, conv_id: str, size: int,
+                 factory: Callable[[str, str], Any] = get_exec_client):
+        """
+        参数:
+            url: 远程执行服务的 URL（本地模式下忽略）
+            conv_id: 基础会话ID
+            size: 客户端数量，即并发度
+            factory: factory(url, conv_id) -> 客户端，默认按配置创建代码执行客户端
+        """
+        if factory is get_exec_client:
+            # 提交任务之前先让执行后端开始预热，第一批任务不必各自等待内核启动
+            prewarm_exec_clients(size)
+        self.clients = [
+            factory(url, worker_conv_id(conv_id, i, size))
+            for i in range(size)
+        ]
+        self._idle = queue.Queue()
+        for client in self.clients:
+            self._idle.put(client)
+
+    def checkout(self):
+        """借出一个空闲客户端，没有空闲时阻塞等待"""
+        return self._idle.get()
+
+    def checkin(self, client):
+        """归还客户端"""
+        self._idle.put(client)
+
+
+def run_tasks(
+    tasks: Iterable[Any],
+    task_fn: Callable[[Any, Any], Any],
+    write_fn: Callable[[Any], None],
+    client_pool: ExecClientPool,
+    concurrency: int = 1,
+    desc: str = None,
+) -> None:
+    """
+    并发执行任务，每个任务完成后立即写出结果
+
+    参数:
+        tasks: 任务列表（如 dataset.json 中的条目）
+        task_fn: task_fn(task, client) -> result，在 worker 线程中执行
+        write_fn: write_fn(result)，在主线程中按完成顺序串行调用；
+                  串行时即任务顺序，续跑按 id 判断，不依赖写出顺序
+        client_pool: 代码执行客户端池，大小应不小于 concurrency
+        concurrency: 同时进行的任务数
+        desc: 进度条描述
+    """
+    tasks: List[Any] = list(tasks)
+
+    def run_one(task):
+        client = client_pool.checkout()
+        try:
+            return task_fn(task, client)
+        finally:
+            # 清空本任务遗留的状态，避免影响同一 worker 的下一个任务
+            reset_exec_client(client)
+            client_pool.checkin(client)
+
+    if concurrency <= 1:
+        # 串行路径与原实现一致
+        for task in tqdm(tasks, desc=desc):
+            write_fn(run_one(task))
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            tqdm(total=len(tasks), desc=desc) as pbar:
+        futures = [executor.submit(run_one, task) for task in tasks]
+        for future in as_completed(futures):
+            write_fn(future.result())
+            pbar.update(1)
+
+
+async def arun_tasks(
+    tasks: Iterable[Any],
+    task_fn: Callable[[Any, Any], Awaitable[Any]],
+    write_fn: Callable[[Any], None],
+    client_pool: ExecClientPool,
+    concurrency: int = 1,
+    desc: str = None,
+) -> None:
+    """
+    在事件循环中并发推进任务（如多轮对话），每个任务完成后立即写出结果
+
+    与 run_tasks 相同，每个任务独占一个代码执行客户端；不同的是 task_fn 是协程，
+    任务在等待模型回复时让出事件循环，所有进行中任务的模型请求同时发往服务端，
+    由服务端（如 vLLM）合并成批处理
+
+    参数:
+        tasks: 任务列表
+        task_fn: async task_fn(task, client) -> result，阻塞的操作（代码执行、读表格、分词）
+                 应放到线程中运行；抛出异常的任务会被打印并跳过，不影响其他任务
+        write_fn: write_fn(result)，在事件循环中按完成顺序调用
+        client_pool: 代码执行客户端池，大小应不小于 concurrency
+        concurrency: 同时进行的任务数
+        desc: 进度条描述
+    """
+    tasks: List[Any] = list(tasks)
+    concurrency = max(concurrency, 1)
+    loop = asyncio.get_running_loop()
+    # 每个进行中的任务至多占用一个线程执行代码
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for task in tasks:
+        pending.put_nowait(task)
+
+    with tqdm(total=len(tasks), desc=desc) as pbar:
+        async def worker():
+            while not pending.empty():
+                task = pending.get_nowait()
+                client = client_pool.checkout()
+                try:
+                    result = await task_fn(task, client)
+                except Exception as e:
+                    # 单个任务出错不影响其他进行中的任务；不写出结果，续跑时会重新运行
+                    print(f"Task failed: {type(e).__name__}: {e}")
+                    result = None
+                finally:
+                    # 清空本任务遗留的状态，避免影响同一 worker 的下一个任务
+                    await loop.run_in_executor(None, reset_exec_client, client)
+                    client_pool.checkin(client)
+                if result is not None:
+                    write_fn(result)
+                pbar.update(1)
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(tasks)))))
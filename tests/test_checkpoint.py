@@ -0,0 +1,42 @@
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'inference'))
+
+from checkpoint import append_jsonl, dataset_order, load_records, sort_jsonl
+from task_scheduler import ExecClientPool, run_tasks
+
+
+def test_shuffled_completion_is_rewritten_in_dataset_order(tmp_path):
+    path = str(tmp_path / 'conv.jsonl')
+    dataset = [{'id': f'task-{i}'} for i in range(40)]
+    rng = random.Random(0)
+    delays = {data['id']: rng.random() * 0.02 for data in dataset}
+
+    def solve(data, client):
+        time.sleep(delays[data['id']])
+        return {'id': data['id']}
+
+    client_pool = ExecClientPool('', 'conv', 8, factory=lambda url, conv_id: object())
+    run_tasks(dataset, solve, lambda record: append_jsonl(path, record), client_pool, concurrency=8)
+    completed = [record['id'] for record in load_records(path)]
+    assert sorted(completed) == sorted(data['id'] for data in dataset)
+    # tasks finished out of dataset order
+    assert completed != [data['id'] for data in dataset]
+
+    sort_jsonl(path, dataset_order([data['id'] for data in dataset]))
+    assert [record['id'] for record in load_records(path)] == [data['id'] for data in dataset]
+
+
+def test_sort_is_stable_and_keeps_unknown_ids_last(tmp_path):
+    path = str(tmp_path / 'conv.jsonl')
+    for record in [{'id': 'b', 'n': 1}, {'id': 'x'}, {'id': 'a'}, {'id': 'b', 'n': 2}]:
+        append_jsonl(path, record)
+    sort_jsonl(path, dataset_order(['a', 'b']))
+    with open(path) as fp:
+        records = [json.loads(line) for line in fp]
+    assert records == [{'id': 'a'}, {'id': 'b', 'n': 1}, {'id': 'b', 'n': 2}, {'id': 'x'}]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
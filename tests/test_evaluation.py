@@ -0,0 +1,71 @@
+import os
+import sys
+import math
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'evaluation'))
+
+from evaluation import (block_mismatches, compare_cell_value, compile_answer_position, normalize_block,
+                        round_array)
+
+
+def random_value(rng):
+    kind = rng.randrange(9)
+    if kind == 0:
+        return None
+    if kind == 1:
+        return ""
+    if kind == 2:
+        return rng.randint(-5, 5)
+    if kind == 3:
+        # three decimals hit the half-way cases of rounding to two
+        return rng.randint(-2000, 2000) / 1000
+    if kind == 4:
+        return str(rng.randint(-2000, 2000) / 1000)
+    if kind == 5:
+        return rng.choice(["a", "b", "1.0.0", "nan"])
+    if kind == 6:
+        return datetime.datetime(2024, 1, rng.randint(1, 3), rng.choice([0, 12]))
+    if kind == 7:
+        return datetime.time(rng.randint(0, 1), rng.choice([0, 30]))
+    return rng.choice([True, False])
+
+
+def test_block_mismatches_matches_compare_cell_value():
+    rng = random.Random(0)
+    for _ in range(3000):
+        gt = [[random_value(rng) for _ in range(3)] for _ in range(3)]
+        proc = [[random_value(rng) if rng.random() < 0.5 else gt[i][j] for j in range(3)] for i in range(3)]
+        if rng.random() < 0.5:
+            # values one thousandth apart around the rounding boundary
+            proc = [[v + 0.001 if isinstance(v, float) else v for v in row] for row in proc]
+        mismatches = block_mismatches(normalize_block(gt), normalize_block(proc))
+        for i in range(3):
+            for j in range(3):
+                assert mismatches[i, j] == (not compare_cell_value(gt[i][j], proc[i][j])), (gt[i][j], proc[i][j])
+
+
+def test_rounding_follows_builtin_round():
+    for gt, proc in [(0.765, 0.766), (5.515, 5.516), ("0.765", 0.766)]:
+        mismatch = block_mismatches(normalize_block([[gt]]), normalize_block([[proc]]))[0, 0]
+        assert mismatch == (not compare_cell_value(gt, proc))
+
+
+def test_round_array_matches_builtin_round():
+    rng = random.Random(0)
+    values = [rng.randint(-10 ** 6, 10 ** 6) / 1000 + rng.choice([0, 0.005, -0.005]) for _ in range(20000)]
+    values += [rng.uniform(-1e9, 1e9) for _ in range(5000)]
+    values += [1e17 + 0.5, 1e308, -1e308, math.inf, 0.0, -0.0]
+    assert list(round_array(values, 2)) == [round(v, 2) for v in values]
+    assert math.isnan(round_array([math.nan], 2)[0])
+
+
+def test_compile_answer_position_keeps_original_parsing():
+    assert compile_answer_position("Sheet1!A1:B2") == (("Sheet1", 1, 2, 1, 2),)
+    assert compile_answer_position("'Sheet 1'!C3") == (("Sheet 1", 3, 3, 3, 3),)
+    assert compile_answer_position("A1:A3") == ((None, 1, 3, 1, 1),)
+    # whitespace after a comma stays part of the sheet name and does not match any sheet
+    assert compile_answer_position("Sheet1!A1:B2, Sheet1!C1")[1][0] == " Sheet1"
+    # escaped quotes are not unescaped
+    assert compile_answer_position("'It''s'!A1")[0][0] == "It''s"
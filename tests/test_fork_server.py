@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'inference'))
+
+from execution_result import ExecutionResult
+from fork_server import Session
+
+CELLS = [
+    "x = 1",
+    "1/0",
+    "def f(a):\n    return a / 0\nf(3)",
+    "import json\njson.loads('{')",
+    "y = undefined_name",
+]
+
+
+def ipython_error_summaries(cells):
+    """在 IPython shell 中执行，按 Jupyter 内核 error 消息的 traceback 构造结果"""
+    interactiveshell = pytest.importorskip('IPython.core.interactiveshell')
+    shell = interactiveshell.InteractiveShell.instance(colors='NoColor')
+    captured = []
+    shell._showtraceback = lambda etype, evalue, stb: captured.append((etype.__name__, str(evalue), stb))
+    summaries = []
+    for code in cells:
+        captured.clear()
+        shell.run_cell(code, store_history=True)
+        if not captured:
+            summaries.append(None)
+            continue
+        result = ExecutionResult()
+        result.set_error(*captured[0])
+        summaries.append(result.error_summary())
+    interactiveshell.InteractiveShell.clear_instance()
+    return summaries
+
+
+def test_error_summary_matches_ipython_kernel():
+    expected = ipython_error_summaries(CELLS)
+    session = Session()
+    for code, summary in zip(CELLS, expected):
+        result = session.run(code, timeout=10)
+        if summary is None:
+            assert result.status != 'error'
+        else:
+            assert result.error_summary() == summary
+
+
+def test_frames_are_ipython_shaped():
+    result = Session().run("1/0", timeout=10)
+    assert result.traceback[0] == '-' * 75
+    assert result.traceback[1].startswith('ZeroDivisionError') and len(result.traceback[1]) == 75
+    assert result.traceback[2] == "Cell In[1], line 1\n----> 1 1/0\n"
+    assert result.error_summary() == (
+        "ZeroDivisionError                         Traceback (most recent call last)\n"
+        "Cell In[1], line 1\n----> 1 1/0\n"
+        "ZeroDivisionError: division by zero"
+    )